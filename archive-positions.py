@@ -0,0 +1,39 @@
+"""
+This script moves finished positions (closed, opening-cancelled, closing-cancelled)
+out of the positions collection into positions_archive, keeping per market and
+day rollups of the closures for the reporters.
+"""
+import yaml
+import argparse
+import datetime as dt
+from pymongo import MongoClient
+
+from dumbot.archive import archive_positions, ensure_indexes
+
+parser = argparse.ArgumentParser(description='Archives finished positions older than the retention window.')
+parser.add_argument('--retention-days', type=int, required=False, default=30,
+                    help='Finished positions last updated more than this many days ago get archived')
+parser.add_argument('--batch-size', type=int, required=False, default=1000,
+                    help='Positions moved per bulk operation')
+parser.add_argument('--config', type=str, required=False, default="config.yml",
+                    help='Config file')
+
+args = parser.parse_args()
+
+try:
+    # Load configuration
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+    # Initialize mongo api
+    mongo = MongoClient(config.get('db', None))
+    mongo.server_info()
+    db = mongo[config.get('db_name', 'dumbot')]
+
+    ensure_indexes(db)
+    older_than = dt.datetime.utcnow() - dt.timedelta(days=args.retention_days)
+    moved = archive_positions(db, older_than, batch_size=args.batch_size)
+    print("%s - %s positions archived" % (dt.datetime.now(), moved))
+except Exception as e:
+    print("%s - Error: %s" % (dt.datetime.now(), e))
+finally:
+    print("%s - Stopped" % dt.datetime.now())
@@ -2,191 +2,372 @@
 This script check for open positions and apply a trailing stoploss algorithm on each one
 """
 import yaml
-import math
 import argparse
 import datetime as dt
 import time
-from pymongo import MongoClient
+import threading
+import functools
+import os
+import socket
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 
-from bittrex.bittrex import Bittrex, API_V2_0, API_V1_1
-
-from binance.client import Client as Binance
-from binance.enums import *
+from dumbot.brokers import make_broker, BROKERS
+from dumbot.positions import find_positions, TRAILING_FIELDS
+from dumbot.price_history import PriceHistory, changed
+from dumbot.ticks import TickRecorder
+from dumbot.checkpoint import Checkpoint, supervise
+from dumbot.accounts import load_accounts, account_filter
+from dumbot.price_cache import PriceCache, cache_path
+from dumbot.replay import Harness
+from dumbot.profiler import SamplingProfiler
+from dumbot.exposure import ExposureBook, publish
 
 parser = argparse.ArgumentParser(description='Automatic exchange trailing stoploss bot.')
-parser.add_argument('--exchange', choices=['bittrex', 'binance'], required=True,
-                    help='Exchange to use')
+parser.add_argument('--exchange', choices=sorted(BROKERS.keys()), required=False, default=None,
+                    help='Exchange to use, defaults to every exchange having an account in config')
+parser.add_argument('--accounts', type=str, required=False, default=None,
+                    help='Comma separated accounts to manage, defaults to every account of the exchange(s)')
 parser.add_argument('--stop-loss-percent', type=float, required=False, default=10,
                     help='Percentage of value decrease to trigger a stoploss action')
 parser.add_argument('--dry-run', action='store_true',
                     help='If set, no sells will be placed.')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
+parser.add_argument('--write-epsilon', type=float, required=False, default=0.001,
+                    help='Relative price or stop change below which positions are not updated')
+parser.add_argument('--history-interval', type=int, required=False, default=60,
+                    help='Seconds between two points of a market in price_history')
+parser.add_argument('--record-ticks', type=str, required=False, default=None,
+                    help='Directory where every fetched price is recorded (see dumbot.ticks)')
+parser.add_argument('--price-max-age', type=float, required=False, default=10,
+                    help='Age in seconds above which host price cache prices are ignored, 0 disables the cache')
+parser.add_argument('--wick-lookback', type=float, required=False, default=60,
+                    help='Seconds of low/high traded since the previous evaluation used by the stops, 0 disables')
+parser.add_argument('--record', type=str, required=False, default=None,
+                    help='Record exchange calls and database reads to this file (see dumbot.replay)')
+parser.add_argument('--replay', type=str, required=False, default=None,
+                    help='Replay a recording instead of connecting to the exchanges and the database')
+parser.add_argument('--replay-pace', action='store_true',
+                    help='Replay at the recorded pace instead of full speed')
+parser.add_argument('--profile-dir', type=str, required=False, default='profiles',
+                    help='Sampling profiler output, toggled with SIGUSR1 or <profile-dir>/ENABLED (see dumbot.profiler)')
+parser.add_argument('--checkpoint', type=str, required=False, default=None,
+                    help='Warm state snapshot file, defaults to trailing-stoploss-<exchange|all>.checkpoint')
 
 args = parser.parse_args()
+if args.checkpoint is None:
+    args.checkpoint = 'trailing-stoploss-%s.checkpoint' % (args.exchange or 'all')
 
 STOPLOSS_PERCENTAGE = args.stop_loss_percent
 DRY_RUN = args.dry_run
+WRITE_EPSILON = args.write_epsilon
 
-def step_size_to_precision(ss):
-    return max(ss.find('1'), 1) - 1
+# Claims are never expired: a position left 'closing' without close order by a
+# crashed worker is reported by update-ing-orders.py rather than sold twice
+WORKER_ID = '%s:%s' % (socket.gethostname(), os.getpid())
 
-def format_value(val, step_size):
-    digits = step_size_to_precision('%s' % step_size)
-    val *= 10 ** digits
-    return '{1:.{0}f}'.format(digits, math.floor(val) / 10 ** digits)
+checkpoint = Checkpoint(args.checkpoint)
+harness = Harness(args.record, args.replay, args.replay_pace)
+# A replay starts from the state saved in the recording
+state = harness.state(None if harness.replaying else checkpoint.load())
+profiler = SamplingProfiler(args.profile_dir).start()
 
-try:
-    # Load configuration
-    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
 
-    # Initialize mongo api
-    mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
-    db = mongo[config.get('db_name', 'dumbot')]
+def claim_position(db, position_id):
+    """Atomically move an open position to 'closing' for this worker, False if another worker holds it"""
+    claimed = db.positions.find_one_and_update({
+        '_id': position_id,
+        'status': 'open',
+    }, {'$set': {
+        'status': 'closing',
+        'close_claimed_by': WORKER_ID,
+        'close_claimed_at': dt.datetime.utcnow(),
+    }, '$unset': {
+        'close_order_id': True,
+    }}, projection={'_id': True}, return_document=ReturnDocument.AFTER)
+    return claimed is not None
+
+
+def release_positions(db, position_ids):
+    """Give back to 'open' the positions claimed by this worker whose sell was not placed"""
+    db.positions.update_many({
+        '_id': {'$in': position_ids},
+        'status': 'closing',
+        'close_claimed_by': WORKER_ID,
+        'close_order_id': None,
+    }, {
+        '$set': {'status': 'open'},
+        '$unset': {'close_claimed_by': True, 'close_claimed_at': True},
+    })
+
+
+def close_positions(db, broker, market, group, price):
+    """Close the positions `group` [(id, close payload, closure reason)] of `market` with a single sell order
+
+    Positions share the order, update-ing-orders.py splits its fills back to
+    each position by its `close_volume` share of `close_group_volume`.
+    """
+    claimed = []
+    for _id, _payload, _reason in group:
+        if _payload.get('errors'):
+            print(" > Position %s cannot be closed: %s" % (_id, ', '.join(_payload['errors'])))
+        elif claim_position(db, _id):
+            claimed.append((_id, _payload, _reason))
+        else:
+            print(" > Position %s already claimed by another worker" % _id)
+    if len(claimed) == 0:
+        return
+
+    volume = sum(_payload['volume'] for _id, _payload, _reason in claimed)
+    try:
+        if len(claimed) == 1:
+            close_order_id = broker.submit_close(claimed[0][1], price)
+        else:
+            print(" > Closing %d %s positions with one order of %s" % (len(claimed), market, volume))
+            close_order_id = broker.sell_limit(market, volume, price)
+    except Exception:
+        # Release the claims, positions are retried on next cycle
+        release_positions(db, [_id for _id, _payload, _reason in claimed])
+        raise
+
+    # Positions stay claimed 'closing' whatever happens now, the order is placed
+    try:
+        db.positions.bulk_write([UpdateOne({'_id': _id}, {
+            '$set': {
+                'status': 'closing',
+                'close_order_id': close_order_id,
+                # Quantity sold for this position, its share of the order
+                'close_volume': _payload['volume'],
+                'close_group_volume': volume,
+                'closure_reason': _reason,
+                'close_rate': price,
+                'closed_at': dt.datetime.utcnow(),
+                'last_update_at': dt.datetime.utcnow(),
+            }}) for _id, _payload, _reason in claimed], ordered=False)
+    except Exception as e:
+        raise Exception("Sell order %s of positions %s placed but not recorded, fix them manually: %s" % (
+            close_order_id, ', '.join(str(_id) for _id, _payload, _reason in claimed), e))
+
 
-    # Exchange API keys
-    API_KEY = config.get('%s_api_key' % args.exchange, None)
-    API_SECRET = config.get('%s_api_secret' % args.exchange, None)
+def run_account(db, account, price_history, tick_recorder, price_cache_path):
+    """Trailing stoploss loop of one exchange account"""
     SLEEP_SECONDS = 5
 
     # Initialize exchange api
-    if args.exchange == 'bittrex':
-        api = Bittrex(API_KEY, API_SECRET, api_version=API_V1_1)
-    elif args.exchange == 'binance':
-        api = Binance(API_KEY, API_SECRET)
-
-        # Is binance alive ?
-        if api.get_system_status().get("status", -1) != 0:
-            raise Exception("Exchange unavailable for trading")
-    else:
-        raise NotImplementedError
-
-    exchange_symbols = {}
-    r = api.get_exchange_info()
-    for symbol in r.get('symbols'):
-        # Rebuild the filters array
-        filters = {}
-        for filter in symbol['filters']:
-            filters[filter['filterType']] = filter
-        symbol['filters'] = filters
-
-        exchange_symbols[symbol.get('symbol')] = symbol
-
-    while True:
-        ticker_cache = {}
-        for position in db.positions.find({"$and":[
-            {"status": "open"},
-            {"broker": args.exchange}
-        ]}):
-            try:
-                # Positions values
-                POS_AMOUNT = position.get('volume')
-                POS_BUY_PRICE = position.get('open_rate')
-
-                # Init. stoppers configuration
-                STOPLOSS_LIMIT = position.get('stop_loss', None)
-
-                # Get ticker value
-                if "%s" % (position.get('market')) not in ticker_cache:
-                    if args.exchange == 'bittrex':
-                        r = api.get_ticker(position.get('market'))
-                        ticker_cache[position.get('market')] = r.get('result', {}).get('Last', None)
-                    elif args.exchange == 'binance':
-                        r = api.get_ticker(symbol=position.get('market'))
-                        ticker_cache[position.get('market')] = r.get('lastPrice', None)
-                    if ticker_cache[position.get('market')] is None:
-                        print("Cannot get last ticker value for %s" % (position.get('market')))
-                        continue
+    # Recorded and replayed runs read prices from the exchange only
+    use_price_cache = args.price_max_age > 0 and not harness.active
+    # The state is shared with the other accounts and saved by the main thread
+    with checkpoint.lock:
+        broker = make_broker(account, state, PriceCache.open(price_cache_path) if use_price_cache else None,
+                             args.price_max_age, harness)
+        account_state = state.setdefault('accounts', {}).setdefault(
+            '%s/%s' % (account['exchange'], account['name']), {})
+        last_prices = account_state.setdefault('last_prices', {})
+        # Time of the previous evaluation of each market, the wicks are looked for since then.
+        # Restored from the checkpointed last prices, a restart looks for the wicks it missed
+        evaluated_at = dict((_market, _at) for _market, (_price, _at) in last_prices.items())
+    db = harness.database(db, 'mongo/%s/%s' % (account['exchange'], account['name']))
+    # Running exposure totals of the account, published every cycle (see dumbot.exposure)
+    exposure_book = ExposureBook()
+
+    try:
+        while True:
+            profiler.begin_cycle()
+            positions_count = 0
+            ticker_cache = {}
+            wick_cache = {}
+            triggered = {}
+            seen_positions = set()
+            for position in find_positions(db.positions, {"$and": [
+                {"status": "open"},
+                {"broker": account['exchange']},
+                account_filter(account)
+            ]}, TRAILING_FIELDS):
+                try:
+                    positions_count += 1
+                    seen_positions.add(position.id)
+                    # Positions values
+                    POS_MARKET = position.market
+                    POS_AMOUNT = position.volume
+                    POS_BUY_PRICE = position.open_rate
+
+                    # Init. stoppers configuration
+                    STOPLOSS_LIMIT = position.stop_loss
+
+                    # Get ticker value
+                    if POS_MARKET not in ticker_cache:
+                        _evaluated_at = time.time()
+                        ticker_cache[POS_MARKET], _volume = broker.last_price(POS_MARKET)
+                        if ticker_cache[POS_MARKET] is None:
+                            print("Cannot get last ticker value for %s" % POS_MARKET)
+                            continue
+                        else:
+                            price_history.observe(POS_MARKET, ticker_cache[POS_MARKET])
+                            with checkpoint.lock:
+                                last_prices[POS_MARKET] = (ticker_cache[POS_MARKET], time.time())
+                            if tick_recorder is not None:
+                                tick_recorder.record(POS_MARKET, ticker_cache[POS_MARKET], _volume)
+
+                            # Low and high traded between the previous evaluation and this one
+                            if args.wick_lookback > 0 and POS_MARKET in evaluated_at:
+                                wick_cache[POS_MARKET] = broker.price_range(
+                                    POS_MARKET, max(evaluated_at[POS_MARKET], _evaluated_at - args.wick_lookback))
+                            evaluated_at[POS_MARKET] = _evaluated_at
+
+                    _LAST_TICKER_VALUE = ticker_cache[POS_MARKET]
+                    _LOW, _HIGH = wick_cache.get(POS_MARKET, (None, None))
+                    _LOW = min(_LOW, _LAST_TICKER_VALUE) if _LOW is not None else _LAST_TICKER_VALUE
+                    _HIGH = max(_HIGH, _LAST_TICKER_VALUE) if _HIGH is not None else _LAST_TICKER_VALUE
+
+                    # Recalculate the stoppers limits
+                    # Where:
+                    # - STOPLOSS will never get lower than previous iterations
+                    # - STOPLOSS follows the highest price traded since the previous evaluation
+                    if _HIGH > POS_BUY_PRICE:
+                        _sl = _HIGH - (_HIGH * STOPLOSS_PERCENTAGE / 100)
+                        if STOPLOSS_LIMIT is None or _sl > STOPLOSS_LIMIT:
+                            STOPLOSS_LIMIT = _sl
                     else:
-                        ticker_cache[position.get('market')] = float(ticker_cache[position.get('market')])
-
-                _LAST_TICKER_VALUE = ticker_cache[position.get('market')]
-
-                # Update the position information
-                db.positions.update_one({'_id': position.get('_id')}, {
-                    '$set': {
-                        'current_price': _LAST_TICKER_VALUE,
-                        'price_at': dt.datetime.utcnow(),
-                        'last_update_at': dt.datetime.utcnow(),
-                    }})
-
-                # Recalculate the stoppers limits
-                # Where:
-                # - STOPLOSS will never get lower than previous iterations
-                if _LAST_TICKER_VALUE > POS_BUY_PRICE:
-                    _sl = _LAST_TICKER_VALUE - (_LAST_TICKER_VALUE * STOPLOSS_PERCENTAGE / 100)
-                    if STOPLOSS_LIMIT is None or _sl > STOPLOSS_LIMIT:
-                        STOPLOSS_LIMIT = _sl
-                else:
-                    _sl = POS_BUY_PRICE - (POS_BUY_PRICE * STOPLOSS_PERCENTAGE / 100)
-                    if STOPLOSS_LIMIT is None or _sl > STOPLOSS_LIMIT:
-                        STOPLOSS_LIMIT = _sl
-
-                # Recalculate the net
-                expected_net = (POS_AMOUNT * _LAST_TICKER_VALUE) - (POS_AMOUNT * POS_BUY_PRICE)
-                expected_net_percent = (((POS_AMOUNT * _LAST_TICKER_VALUE) * 100) / (POS_AMOUNT * POS_BUY_PRICE)) - 100
-                stop_loss_percent = (((POS_AMOUNT * STOPLOSS_LIMIT) * 100) / (POS_AMOUNT * POS_BUY_PRICE)) - 100
-                db.positions.update_one({'_id': position.get('_id')}, {
-                    '$set': {
-                        'stop_loss_percent': stop_loss_percent,
-                        'stop_loss': STOPLOSS_LIMIT,
-                        'expected_net': expected_net,
-                        'expected_net_percent': expected_net_percent,
-                        'last_update_at': dt.datetime.utcnow(),
-                    }})
-                print(" > %s Last:%s, Stop loss @%s" % (
-                    position.get('market'), _LAST_TICKER_VALUE, STOPLOSS_LIMIT))
-
-                # If limits are defined and reached then we may close positions
-                closure_reason = None
-                if STOPLOSS_LIMIT is not None and _LAST_TICKER_VALUE <= STOPLOSS_LIMIT:
-                    closure_reason = 'stoploss'
-
-                # Get the hell out of here, we closed the position
-                if closure_reason is not None:
-                    print(" > Closing position %s %s@%s on %s @%s, expected_net:%s" % (
-                        position.get('market'), POS_AMOUNT, POS_BUY_PRICE,
-                        closure_reason, _LAST_TICKER_VALUE, expected_net))
-
-                    if not DRY_RUN and not position.get('hodl', False):
-                        if args.exchange == 'bittrex':
-                            r = api.sell_limit("%s" % position.get('market'),
-                                               quantity=POS_AMOUNT, rate=_LAST_TICKER_VALUE)
-                            if not r.get('success', False):
-                                raise Exception("Could not close position on broker: %s" % r)
-                            close_order_id = r.get('result', {}).get('uuid', None)
-                        elif args.exchange == 'binance':
-                            step_size = exchange_symbols.get(
-                                position.get('market'), {}).get('filters', {}).get(
-                                'LOT_SIZE', {}).get('stepSize', 0.00000001)
-                            _stepped_pos_amount = format_value(POS_AMOUNT, step_size)
-
-                            r = api.order_limit_sell(symbol="%s" % position.get('market'),
-                                               quantity=_stepped_pos_amount, price=_LAST_TICKER_VALUE)
-                            if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId',
-                                                                                                           None) is None:
-                                raise Exception("Could not close position on broker: %s" % r)
-                            close_order_id = r.get('orderId')
-
-                        db.positions.update_one({'_id': position.get('_id')}, {
+                        _sl = POS_BUY_PRICE - (POS_BUY_PRICE * STOPLOSS_PERCENTAGE / 100)
+                        if STOPLOSS_LIMIT is None or _sl > STOPLOSS_LIMIT:
+                            STOPLOSS_LIMIT = _sl
+
+                    # Recalculate the net
+                    expected_net = (POS_AMOUNT * _LAST_TICKER_VALUE) - (POS_AMOUNT * POS_BUY_PRICE)
+                    expected_net_percent = (((POS_AMOUNT * _LAST_TICKER_VALUE) * 100) / (POS_AMOUNT * POS_BUY_PRICE)) - 100
+                    stop_loss_percent = (((POS_AMOUNT * STOPLOSS_LIMIT) * 100) / (POS_AMOUNT * POS_BUY_PRICE)) - 100
+
+                    # Prepare the close order ahead of the trigger, again whenever the stop ratchets
+                    # or the position volume changed (commission taken once the opening completed)
+                    _stop_moved = changed(position.stop_loss, STOPLOSS_LIMIT, WRITE_EPSILON)
+                    close_payload = position.close_payload
+                    _payload_stale = close_payload is None or \
+                        close_payload.get('volume') != broker.close_volume(POS_MARKET, POS_AMOUNT)
+                    if _payload_stale or _stop_moved:
+                        close_payload = broker.close_payload(POS_MARKET, POS_AMOUNT, STOPLOSS_LIMIT)
+
+                    # Update the position information, only if price or stop moved enough
+                    if changed(position.current_price, _LAST_TICKER_VALUE, WRITE_EPSILON) or _stop_moved or \
+                            _payload_stale:
+                        db.positions.update_one({'_id': position.id}, {
                             '$set': {
-                                'status': 'closing',
-                                'close_order_id': close_order_id,
-                                'closure_reason': closure_reason,
-                                'close_rate': _LAST_TICKER_VALUE,
-                                'closed_at': dt.datetime.utcnow(),
+                                'close_payload': close_payload,
+                                'current_price': _LAST_TICKER_VALUE,
+                                'price_at': dt.datetime.utcnow(),
+                                'stop_loss_percent': stop_loss_percent,
+                                'stop_loss': STOPLOSS_LIMIT,
+                                'expected_net': expected_net,
+                                'expected_net_percent': expected_net_percent,
                                 'last_update_at': dt.datetime.utcnow(),
                             }})
-                    else:
-                        print(" > DRY_RUN mode: position not closed (hodl:%s)." % position.get('hodl', False))
+                    exposure_book.update(position.id, POS_MARKET, broker.base_asset(POS_MARKET), POS_AMOUNT,
+                                         _LAST_TICKER_VALUE, POS_BUY_PRICE, STOPLOSS_LIMIT)
+                    print(" > %s Last:%s (low:%s, high:%s), Stop loss @%s" % (
+                        POS_MARKET, _LAST_TICKER_VALUE, _LOW, _HIGH, STOPLOSS_LIMIT))
+
+                    # If limits are defined and reached then we may close positions
+                    # The low may have been traded before the high, so it is only held against
+                    # the stop in place before this evaluation, the last price against the new one
+                    closure_reason = None
+                    if STOPLOSS_LIMIT is not None and _LAST_TICKER_VALUE <= STOPLOSS_LIMIT:
+                        closure_reason = 'stoploss'
+                    elif position.stop_loss is not None and _LOW <= position.stop_loss:
+                        print(" > %s traded down to %s through the stop loss @%s" % (
+                            POS_MARKET, _LOW, position.stop_loss))
+                        closure_reason = 'stoploss'
+
+                    # Get the hell out of here, we closed the position
+                    if closure_reason is not None:
+                        print(" > Closing position %s %s@%s on %s @%s, expected_net:%s" % (
+                            POS_MARKET, POS_AMOUNT, POS_BUY_PRICE,
+                            closure_reason, _LAST_TICKER_VALUE, expected_net))
+
+                        if not DRY_RUN and not position.hodl:
+                            # Sold with the other positions of the market triggered in this cycle
+                            triggered.setdefault(POS_MARKET, []).append((position.id, close_payload, closure_reason))
+                        else:
+                            print(" > DRY_RUN mode: position not closed (hodl:%s)." % bool(position.hodl))
+                        continue
+                except Exception as e:
+                    print("[%s/%s] Error in position handling: %s" % (account['exchange'], account['name'], e))
                     continue
+
+            for market, group in triggered.items():
+                try:
+                    close_positions(db, broker, market, group, ticker_cache[market])
+                except Exception as e:
+                    print("[%s/%s] Error in %s closure: %s" % (account['exchange'], account['name'], market, e))
+
+            try:
+                exposure_book.retain(seen_positions)
+                publish(db.exposure, account['exchange'], account['name'], exposure_book)
             except Exception as e:
-                print("Error in position handling: %s" % e)
-                continue
+                print("[%s/%s] Error in exposure publishing: %s" % (account['exchange'], account['name'], e))
+
+            profiler.end_cycle(positions=positions_count)
+            harness.sleep(SLEEP_SECONDS)
+    finally:
+        # A restarted loop builds a new broker, stop the threads of this one
+        broker.close()
+
+
+def run():
+    # Load configuration
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+    # Initialize mongo api, replays never connect
+    db = None
+    if not harness.replaying:
+        mongo = MongoClient(config.get('db', None))
+        mongo.server_info()
+        db = mongo[config.get('db_name', 'dumbot')]
+
+    # Exchange accounts
+    accounts = load_accounts(config, args.exchange, args.accounts.split(',') if args.accounts else None)
+    if len(accounts) == 0:
+        raise Exception("No %s account configured" % (args.exchange or 'exchange'))
+
+    # Prices are recorded once per exchange and market whatever the number of accounts
+    history_db = harness.database(db, 'mongo')
+    price_histories = dict((exchange, PriceHistory(history_db, exchange, interval=args.history_interval))
+                           for exchange in set(account['exchange'] for account in accounts))
+    tick_recorder = TickRecorder(args.record_ticks) if args.record_ticks is not None else None
+
+    # One concurrent loop per account
+    tasks = []
+    for account in accounts:
+        task = threading.Thread(target=harness.guard(supervise), daemon=True,
+                                name='%s/%s' % (account['exchange'], account['name']), args=(
+            functools.partial(run_account, db, account, price_histories[account['exchange']], tick_recorder,
+                              cache_path(config, account['exchange'])),
+            'Trailing stoploss [%s/%s]' % (account['exchange'], account['name'])))
+        task.start()
+        tasks.append(task)
 
-        time.sleep(SLEEP_SECONDS)
+    while any(task.is_alive() for task in tasks):
+        try:
+            for price_history in price_histories.values():
+                price_history.flush()
+            if tick_recorder is not None:
+                tick_recorder.flush()
+        except Exception as e:
+            print("Error while writing price history: %s" % e)
+
+        if not harness.replaying:
+            checkpoint.maybe_save(state)
+        time.sleep(5 if not harness.replaying else 0.1)
+
+    # Account loops of a replay stop at the end of the recording
+    if harness.replaying:
+        return
+    raise Exception("All account loops stopped")
+
+
+try:
+    supervise(run, 'Trailing stoploss')
 except Exception as e:
     print("Error: %s" % e)
 finally:
+    profiler.close()
+    harness.close()
     print("Stopped")
@@ -1,100 +1,206 @@
 """
-This script rolls back a selling or buying order:
+This script rolls back selling or buying orders:
  - Opening order will get removed from positions collection
  - Closing order will get back to Open status in positions collection
+
+Orders are selected by id or by filters (market, status, age, distance of the
+order price to the last price), listed for one confirmation, then cancelled
+concurrently under the rate budget and rolled back in one bulk write.
+A closing order shared by several positions is cancelled once and all of its
+positions are rolled back.
 """
-import yaml
 import copy
 import argparse
 import datetime as dt
 import time
-from pymongo import MongoClient
-
-from binance.client import Client as Binance
-from binance.enums import *
 
-parser = argparse.ArgumentParser(description='This script rolls back a selling or buying order')
-parser.add_argument('--order-id', type=int, required=True,
+parser = argparse.ArgumentParser(description='This script rolls back selling or buying orders')
+parser.add_argument('--order-id', type=int, required=False, default=None,
                     help='Order to rollback')
+parser.add_argument('--market', type=str, nargs='+', required=False, default=None,
+                    help='Rollback the orders of these markets')
+parser.add_argument('--status', choices=['opening', 'closing'], required=False, default=None,
+                    help='Rollback only opening or closing orders')
+parser.add_argument('--older-than', type=float, required=False, default=None,
+                    help='Rollback orders placed more than this many minutes ago')
+parser.add_argument('--min-distance', type=float, required=False, default=None,
+                    help='Rollback orders priced at least this percent away from the last price')
+parser.add_argument('--account', type=str, required=False, default=None,
+                    help='Rollback only the orders of this account')
+parser.add_argument('--all', action='store_true',
+                    help='Rollback all the pending orders matching the other filters, even without filters')
+parser.add_argument('--workers', type=int, required=False, default=10,
+                    help='Maximum number of orders cancelled in parallel')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
 
 args = parser.parse_args()
 exchange = 'binance'
 
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, DeleteOne, UpdateOne
+
+from dumbot.accounts import get_account, DEFAULT_ACCOUNT
+from dumbot.rate_budget import binance_budgets
+
+
+def order_of(position):
+    """(order id, order rate, placed at) of the pending order of `position`"""
+    if position['status'] == 'opening':
+        return position['open_order_id'], position.get('open_rate'), position.get('open_at')
+    return position.get('close_order_id'), position.get('close_rate'), position.get('closed_at')
+
+
+def distance_percent(position):
+    _order_id, _rate, _at = order_of(position)
+    if not _rate or position.get('current_price') is None:
+        return None
+    return abs(position['current_price'] - _rate) * 100 / _rate
+
+
+def select_orders(db):
+    """Pending orders matching the arguments: {(account, market, status, order id): [positions]}"""
+    query = {'status': {'$in': [args.status] if args.status else ['opening', 'closing']}, 'broker': exchange}
+    if args.order_id is not None:
+        query['$or'] = [{'status': 'opening', 'open_order_id': args.order_id},
+                        {'status': 'closing', 'close_order_id': args.order_id}]
+    if args.market is not None:
+        query['market'] = {'$in': [_m.upper() for _m in args.market]}
+    if args.account is not None:
+        query['account'] = {'$in': [DEFAULT_ACCOUNT, None]} if args.account == DEFAULT_ACCOUNT else args.account
+
+    placed_before = None
+    if args.older_than is not None:
+        placed_before = dt.datetime.utcnow() - dt.timedelta(minutes=args.older_than)
+
+    orders = {}
+    for position in db.positions.find(query):
+        _order_id, _rate, _at = order_of(position)
+        if _order_id is None:
+            print(" > Position %s is %s without order, skipped" % (position['_id'], position['status']))
+            continue
+        if placed_before is not None and (_at is None or _at > placed_before):
+            continue
+        if args.min_distance is not None:
+            _distance = distance_percent(position)
+            if _distance is None or _distance < args.min_distance:
+                continue
+
+        key = (position.get('account') or DEFAULT_ACCOUNT, position['market'], position['status'], _order_id)
+        orders.setdefault(key, []).append(position)
+    return orders
+
+
+def show_orders(orders):
+    for (account_name, market, status, order_id), positions in sorted(orders.items(), key=lambda _o: _o[0][1]):
+        _order_id, _rate, _at = order_of(positions[0])
+        _distance = distance_percent(positions[0])
+        print("* #%s %s (%s, %s) since %s:\n"
+              "\t- order at %s USDT, now at %s USDT (%s, last update: %s)\n"
+              "\t- %s position(s), volume %s, remaining: %s" % (
+                  order_id,
+                  market,
+                  status,
+                  account_name,
+                  _at,
+                  _rate,
+                  positions[0].get('current_price'),
+                  '%.2f%%' % _distance if _distance is not None else 'n/a',
+                  positions[0].get('price_at'),
+                  len(positions),
+                  sum(_p['volume'] for _p in positions),
+                  sum(_p.get('remaining_volume') or 0 for _p in positions),
+              ))
+
+
+def rollback_requests(status, positions):
+    """Positions collection writes rolling back `positions` once their order is cancelled"""
+    if status == 'opening':
+        return [DeleteOne({'_id': _p['_id'], 'status': 'opening'}) for _p in positions]
+
+    return [UpdateOne({'_id': _p['_id'], 'status': 'closing'}, {
+        '$set': {
+            'status': 'open',
+            'closure_reason': '%s => CANCELLED on %s' % (_p.get('closure_reason'), dt.datetime.utcnow()),
+            'closed_at': None,
+            'last_update_at': dt.datetime.utcnow(),
+        },
+        '$unset': {
+            'close_order_id': True,
+            'close_volume': True,
+            'close_group_volume': True,
+            'close_claimed_by': True,
+            'close_claimed_at': True,
+        }}) for _p in positions]
+
+
+def cancel_orders(db, config, orders):
+    rate_budget, _order_budget = binance_budgets()
+
+    # Initialize exchange apis, imported on use so the orders show up quickly
+    from binance.client import Client as Binance
+    apis = {}
+    for account_name in set(_k[0] for _k in orders):
+        account = get_account(config, exchange, account_name)
+        apis[account_name] = Binance(account['api_key'], account['api_secret'])
+
+    def cancel(key):
+        account_name, market, status, order_id = key
+        rate_budget.acquire('cancel_order')
+        r = apis[account_name].cancel_order(symbol=market, orderId=order_id)
+        if r.get('status') != 'CANCELED':
+            raise Exception("Cannot cancel order on Binance, result: %s" % r)
+        return key
+
+    requests = []
+    cancelled = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for key, future in [(_k, executor.submit(cancel, _k)) for _k in orders]:
+            try:
+                future.result()
+            except Exception as e:
+                print("Error with order #%s %s: %s" % (key[3], key[1], e))
+                continue
+            cancelled += 1
+            requests.extend(rollback_requests(key[2], orders[key]))
+
+    if len(requests) > 0:
+        db.positions.bulk_write(requests, ordered=False)
+    print("Succesfully canceled %s/%s orders, %s positions rolled back" % (cancelled, len(orders), len(requests)))
+
+
 try:
     if exchange != 'binance':
         raise NotImplementedError("Reporter is only implemeted for Binance exchanges")
+    if args.order_id is None and args.market is None and args.status is None and args.older_than is None \
+            and args.min_distance is None and args.account is None and not args.all:
+        raise Exception("Select orders with --order-id or filters, or use --all")
 
     # Load configuration
     config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
 
     # Initialize mongo api
     mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
     db = mongo[config.get('db_name', 'dumbot')]
 
-    # Exchange API keys
-    API_KEY = config.get('%s_api_key' % exchange, None)
-    API_SECRET = config.get('%s_api_secret' % exchange, None)
-
-    # Initialize exchange api
-    api = Binance(API_KEY, API_SECRET)
-    # Is binance alive ?
-    if api.get_system_status().get("status", -1) != 0:
-        raise Exception("Exchange unavailable for trading")
-
-    # Get position details
-    position = db.positions.find_one({"open_order_id": args.order_id})
-    if position is None:
-        raise Exception("Order %s not found !" % args.order_id)
-    if position['status'] not in ['opening', 'closing']:
-        raise Exception("This is not an 'ing' order !")
-
-    # Show position to user
-    print("* #%s %s (%s) since %s:\n"
-          "\t- open at %s USDT, now at %s USDT (last update: %s)\n"
-          "\t- initial volume %s, remaining: %s\n" % (
-              position['open_order_id'],
-              position['market'],
-              position['status'],
-              position['open_at'],
-              position['open_rate'],
-              position['current_price'],
-              position['price_at'],
-              position['volume'],
-              position['remaining_volume'],
-    ))
+    # Get orders details
+    orders = select_orders(db)
+    if len(orders) == 0:
+        raise Exception("No 'ing' order found !")
+
+    # Show orders to user
+    show_orders(orders)
 
     # Can we cancel ?
-    print("# Please confirm canceling order #%s ? (y/n)" % position['open_order_id'])
+    print("\n# Please confirm canceling %s order(s) of %s position(s) ? (y/n)" % (
+        len(orders), sum(len(_p) for _p in orders.values())))
     choice = str(input())
     if choice.lower() != 'y':
         raise Exception("Cancelled")
 
-    # If position were in 'opening' status, then simply clear it from db
-    if position['status'] == 'opening':
-        # Cancel on binance
-        r = api.cancel_order(symbol=position['market'], orderId=position['open_order_id'])
-        if r.get('status') != 'CANCELED':
-            raise Exception("Cannot cancel order on Binance, result: %s" % r)
-
-        db.positions.delete_one({'_id': position['_id']})
-    else:
-        # Cancel on binance
-        r = api.cancel_order(symbol=position['market'], orderId=position['close_order_id'])
-        if r.get('status') != 'CANCELED':
-            raise Exception("Cannot cancel order on Binance, result: %s" % r)
-
-        db.positions.update_one({'_id': position['_id']}, {
-            '$set': {
-                'status': 'open',
-                'closure_reason': '%s => CANCELLED on %s' % (position['closure_reason'], dt.datetime.utcnow()),
-                'closed_at': None,
-                'last_update_at': dt.datetime.utcnow(),
-            }})
-
-    print("Succesfully canceled order #%s" % position['open_order_id'])
+    cancel_orders(db, config, orders)
 except Exception as e:
     print("Error: %s" % e)
 finally:
@@ -0,0 +1,67 @@
+"""
+This script downloads historical klines of the markets in market_settings into
+a local columnar store (see dumbot.klines), resuming from the last stored kline.
+"""
+import yaml
+import argparse
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+from dumbot.klines import KlineStore, download, BINANCE_URL
+from dumbot.rate_budget import RateBudget
+
+parser = argparse.ArgumentParser(description='Historical klines downloader.')
+parser.add_argument('--markets', type=str, required=False, default=None,
+                    help='Comma separated markets, defaults to every market in market_settings')
+parser.add_argument('--intervals', type=str, required=False, default='1m',
+                    help='Comma separated kline intervals (ex: 1m,1h,1d)')
+parser.add_argument('--since', type=str, required=False, default='2019-01-01',
+                    help='Start date (YYYY-MM-DD) of markets not downloaded yet')
+parser.add_argument('--directory', type=str, required=False, default='klines',
+                    help='Store directory')
+parser.add_argument('--workers', type=int, required=False, default=8,
+                    help='Maximum number of markets downloaded in parallel')
+parser.add_argument('--weight-per-minute', type=int, required=False, default=600,
+                    help='Request weight budget, half of the Binance limit by default to leave room for the bots')
+parser.add_argument('--base-url', type=str, required=False, default=BINANCE_URL,
+                    help='Exchange api url')
+parser.add_argument('--config', type=str, required=False, default="config.yml",
+                    help='Config file')
+
+args = parser.parse_args()
+
+try:
+    if args.markets is not None:
+        markets = args.markets.split(',')
+    else:
+        from pymongo import MongoClient
+
+        # Load configuration
+        config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+        # Initialize mongo api
+        mongo = MongoClient(config.get('db', None))
+        mongo.server_info()
+        db = mongo[config.get('db_name', 'dumbot')]
+
+        markets = sorted(set(_o['market'] for _o in db.market_settings.find({}, {'market': True})))
+
+    store = KlineStore(args.directory)
+    rate_budget = RateBudget(args.weight_per_minute, 60)
+    since_ms = int((dt.datetime.strptime(args.since, '%Y-%m-%d') - dt.datetime(1970, 1, 1)).total_seconds() * 1000)
+
+    def job(market, interval):
+        count = download(store, market, interval, since_ms, base_url=args.base_url, rate_budget=rate_budget)
+        print("%s - %s %s: %s klines" % (dt.datetime.now(), market, interval, count))
+
+    jobs = [(market, interval) for market in markets for interval in args.intervals.split(',')]
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for (market, interval), future in [(_j, executor.submit(job, *_j)) for _j in jobs]:
+            try:
+                future.result()
+            except Exception as e:
+                print("%s - Error with %s %s: %s" % (dt.datetime.now(), market, interval, e))
+except Exception as e:
+    print("%s - Error: %s" % (dt.datetime.now(), e))
+finally:
+    print("%s - Stopped" % dt.datetime.now())
@@ -0,0 +1,5 @@
+import sys
+
+from dumbot.cli import main
+
+sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Exchange accounts configuration
+
+Accounts are listed in the config file:
+
+    accounts:
+      - name: main
+        exchange: binance
+        api_key: "..."
+        api_secret: "..."
+
+The legacy `<exchange>_api_key`/`<exchange>_api_secret` keys define an account
+named `default`. Positions are tagged with their account name, positions without
+an `account` field belong to the `default` account.
+"""
+
+DEFAULT_ACCOUNT = 'default'
+
+
+def load_accounts(config, exchange=None, names=None):
+    """Return the configured accounts, optionally filtered by exchange and names"""
+    accounts = []
+    for _a in config.get('accounts', None) or []:
+        accounts.append({
+            'name': _a['name'],
+            'exchange': _a['exchange'],
+            'api_key': _a.get('api_key', None),
+            'api_secret': _a.get('api_secret', None),
+        })
+
+    for _exchange in ['bittrex', 'binance']:
+        if config.get('%s_api_key' % _exchange, None) is not None and \
+                not any(_a['name'] == DEFAULT_ACCOUNT and _a['exchange'] == _exchange for _a in accounts):
+            accounts.append({
+                'name': DEFAULT_ACCOUNT,
+                'exchange': _exchange,
+                'api_key': config.get('%s_api_key' % _exchange, None),
+                'api_secret': config.get('%s_api_secret' % _exchange, None),
+            })
+
+    if exchange is not None:
+        accounts = [_a for _a in accounts if _a['exchange'] == exchange]
+    if names is not None:
+        accounts = [_a for _a in accounts if _a['name'] in names]
+    return accounts
+
+
+def get_account(config, exchange, name=None):
+    """Return one account of `exchange`, the default one if `name` is not given"""
+    accounts = load_accounts(config, exchange, [name or DEFAULT_ACCOUNT])
+    if len(accounts) == 0:
+        raise Exception("No %s account named %s in config" % (exchange, name or DEFAULT_ACCOUNT))
+    return accounts[0]
+
+
+def account_filter(account):
+    """Positions query matching the positions of `account`"""
+    if account['name'] == DEFAULT_ACCOUNT:
+        return {"account": {"$in": [DEFAULT_ACCOUNT, None]}}
+    return {"account": account['name']}
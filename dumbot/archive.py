@@ -0,0 +1,99 @@
+"""
+Hot/cold split of the positions collection
+
+Finished positions (closed, opening-cancelled, closing-cancelled) older than a
+retention window are moved to `positions_archive`. Closed positions are also
+rolled up per broker, market and closure day into `positions_rollups`:
+
+    {'broker': 'binance', 'market': 'BTCUSDT', 'day': <datetime at 00:00>,
+     'closed_positions': 12, 'net': 3.14}
+
+Rollups are recomputed from the archive (never incremented) so archiving can be
+interrupted and run again safely. Reporters add them to the figures they compute
+on the live positions collection, see `archived_closures`.
+"""
+import datetime as dt
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+FINISHED_STATUSES = ['closed', 'opening-cancelled', 'closing-cancelled']
+
+
+def ensure_indexes(db):
+    db.positions_archive.create_index([('status', ASCENDING), ('market', ASCENDING), ('closed_at', ASCENDING)])
+    db.positions_rollups.create_index([('broker', ASCENDING), ('market', ASCENDING), ('day', ASCENDING)],
+                                      unique=True)
+
+
+def _day(at):
+    return dt.datetime(at.year, at.month, at.day)
+
+
+def rollup(db, keys):
+    """Recompute the rollups of `keys` [(broker, market, day)] from positions_archive"""
+    requests = []
+    for broker, market, day in keys:
+        cursor = db.positions_archive.aggregate([
+            {"$match": {'status': 'closed', 'broker': broker, 'market': market,
+                        'closed_at': {"$gte": day, "$lt": day + dt.timedelta(days=1)}}},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$net"}
+            }}
+        ])
+        _res = list(cursor)
+        requests.append(UpdateOne({'broker': broker, 'market': market, 'day': day}, {'$set': {
+            'closed_positions': _res[0]['count'] if len(_res) > 0 else 0,
+            'net': _res[0]['sum'] if len(_res) > 0 else 0,
+        }}, upsert=True))
+
+    if len(requests) > 0:
+        db.positions_rollups.bulk_write(requests, ordered=False)
+
+
+def archive_positions(db, older_than, batch_size=1000):
+    """Move finished positions last updated before `older_than` to positions_archive, return the count"""
+    moved = 0
+    while True:
+        batch = list(db.positions.find({"$and": [
+            {"status": {"$in": FINISHED_STATUSES}},
+            {"last_update_at": {"$lt": older_than}}
+        ]}).limit(batch_size))
+        if len(batch) == 0:
+            return moved
+
+        # Copy, ignoring documents already archived by an interrupted run
+        try:
+            db.positions_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(_e.get('code') != 11000 for _e in e.details.get('writeErrors', [])):
+                raise
+
+        rollup(db, set((p.get('broker'), p.get('market'), _day(p['closed_at']))
+                       for p in batch if p['status'] == 'closed' and p.get('closed_at') is not None))
+
+        db.positions.delete_many({'_id': {'$in': [p['_id'] for p in batch]}})
+        moved += len(batch)
+
+
+def archived_closures(db, market=None, since=None):
+    """Return (closed positions count, net sum) of the archived closures, `since` has a day granularity"""
+    match = {}
+    if market is not None:
+        match['market'] = market
+    if since is not None:
+        match['day'] = {'$gte': _day(since)}
+
+    cursor = db.positions_rollups.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": "$closed_positions"},
+            "sum": {"$sum": "$net"}
+        }}
+    ])
+    _res = list(cursor)
+    if len(_res) == 0:
+        return 0, 0
+    return _res[0]['count'], _res[0]['sum']
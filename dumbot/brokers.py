@@ -0,0 +1,284 @@
+"""
+Common interface over the exchanges used by the trading loops
+
+A broker wraps the api client of one account and hides the exchange specific
+requests and response formats, so a loop can serve bittrex and binance accounts
+with the same code. Exchange libraries are imported by the broker using them.
+
+Brokers given a host price cache (see dumbot.price_cache) read last prices from
+it, and only request the exchange when the cached price is missing or stale.
+The same goes for the low and high traded since a time (`price_range`).
+Exchange requests go through the resilience layer (see dumbot.resilience).
+"""
+from dumbot.exchange import refresh_exchange_symbols
+from dumbot.opening import check_filters
+from dumbot.rate_budget import binance_budgets, RateBudget
+from dumbot.resilience import ResilientCaller
+
+# HTTP timeout of the exchange clients, bounds requests sent without deadline
+HTTP_TIMEOUT = 10
+
+
+class Broker(object):
+    name = None
+    price_cache = None
+    price_max_age = 10
+    # Weight of a request in the rate budget, None uses the endpoint weight (see dumbot.rate_budget)
+    request_weight = None
+
+    def make_api(self, factory, harness):
+        """Exchange client built by `factory`, recorded or replayed by `harness` (see dumbot.replay)"""
+        if harness is None:
+            return factory()
+        return harness.api(factory, '%s/%s' % (self.name, self.account['name']))
+
+    def make_caller(self, harness):
+        caller = ResilientCaller()
+        caller.hedging = harness is None or not harness.active
+        return caller
+
+    def request(self, endpoint, fn, *args, key=None):
+        """Exchange request `fn(*args)` under the rate budget, with deadline, hedging and circuit breaking
+
+        Reads given a `key` fall back to their last value when the request fails.
+        The budget is acquired before the deadline starts, so waiting for it never
+        times a request out nor opens a circuit, and a hedged duplicate is only
+        sent if its tokens are available right away.
+        """
+        weight = self.request_weight or endpoint
+        self.rate_budget.acquire(weight)
+        return self.caller.call(endpoint, fn, *args, key=key,
+                                hedge_gate=lambda: self.rate_budget.try_acquire(weight))
+
+    def close(self):
+        """Stop the hedging threads of the broker, it cannot be used anymore"""
+        self.caller.shutdown()
+
+    def last_price(self, market):
+        """Return (last price, volume) of `market`, price is None if unavailable"""
+        if self.price_cache is not None:
+            price, volume = self.price_cache.quote(market, self.price_max_age)
+            if price is not None:
+                return price, volume
+        return self.fetch_last_price(market)
+
+    def price_range(self, market, since):
+        """Return (low, high) traded on `market` since epoch `since`, (None, None) if unavailable"""
+        if self.price_cache is not None:
+            low, high = self.price_cache.range(market, since, self.price_max_age)
+            if low is not None:
+                return low, high
+        try:
+            return self.fetch_price_range(market, since)
+        except Exception as e:
+            # Never fall back to an older range, it could trigger a stop on past prices
+            print("Cannot get %s price range: %s" % (market, e))
+            return None, None
+
+    def fetch_price_range(self, market, since):
+        return None, None
+
+
+class BittrexBroker(Broker):
+    name = 'bittrex'
+
+    def __init__(self, account, exchange_state, harness=None):
+        from bittrex.bittrex import Bittrex, API_V1_1
+
+        self.account = account
+        self.api = self.make_api(lambda: Bittrex(account['api_key'], account['api_secret'], api_version=API_V1_1),
+                                 harness)
+        # Bittrex has no documented weights, stay under 60 requests per minute
+        self.rate_budget = RateBudget(60, 60)
+        self.request_weight = 1
+        self.caller = self.make_caller(harness)
+
+    def fetch_last_price(self, market):
+        r = self.request('ticker', self.api.get_ticker, market, key=('ticker', market))
+        price = r.get('result', {}).get('Last', None)
+        return (float(price) if price is not None else None), 0
+
+    def base_asset(self, market):
+        """Asset bought on `market`, LTC for BTC-LTC"""
+        return market.split('-')[-1]
+
+    def sell_limit(self, market, quantity, price):
+        """Place a limit sell and return its order id"""
+        r = self.request('order', lambda: self.api.sell_limit(market, quantity=quantity, rate=price))
+        if not r.get('success', False):
+            raise Exception("Could not close position on broker: %s" % r)
+        return r.get('result', {}).get('uuid', None)
+
+    def close_volume(self, market, quantity):
+        """Quantity a close order of `quantity` would sell"""
+        return quantity
+
+    def close_payload(self, market, quantity, stop_price):
+        """Close order of `quantity` prepared ahead of the trigger, see BinanceBroker.close_payload"""
+        return {'symbol': market, 'quantity': quantity, 'volume': quantity, 'errors': []}
+
+    def submit_close(self, payload, price):
+        return self.sell_limit(payload['symbol'], payload['quantity'], price)
+
+    def get_order(self, market, order_id):
+        r = self.request('get_order', self.api.get_order, order_id, key=('order', order_id))
+        if not r.get('success', False):
+            raise Exception("Cannot get order %s: %s" % (order_id, r))
+        return self.order_status(r.get('result', {}))
+
+    def open_orders(self, market):
+        """Status of the open orders of `market` keyed by order id, in one request"""
+        r = self.request('open_orders', self.api.get_open_orders, market)
+        if not r.get('success', False):
+            raise Exception("Cannot get %s open orders: %s" % (market, r))
+        # Listed orders are open, and typed by OrderType instead of Type
+        return dict((_o['OrderUuid'], self.order_status(dict(_o, IsOpen=True, Type=_o.get('OrderType'))))
+                    for _o in r.get('result') or [])
+
+    def order_status(self, order):
+        return {
+            'price': order.get('Price', 0),
+            'type': order.get('Type', None),
+            'is_open': order.get('IsOpen', False),
+            'remaining_quantity': order.get('QuantityRemaining', 0),
+            'cancel_initiated': order.get('CancelInitiated', False),
+            'commission_paid': order.get('CommissionPaid', 0),
+        }
+
+    def trades_commission(self, market, order_id):
+        """Commission taken on the bought asset by the trades of `order_id`"""
+        # Bittrex takes its commission on the market base currency
+        return 0
+
+
+class BinanceBroker(Broker):
+    name = 'binance'
+
+    def __init__(self, account, exchange_state, harness=None):
+        from binance.client import Client as Binance
+
+        self.account = account
+        self.api = self.make_api(lambda: Binance(account['api_key'], account['api_secret'],
+                                                 requests_params={'timeout': HTTP_TIMEOUT}), harness)
+
+        # Is binance alive ?
+        if self.api.get_system_status().get("status", -1) != 0:
+            raise Exception("Exchange unavailable for trading")
+
+        # Each account has its own rate budget
+        self.rate_budget, self.order_budget = binance_budgets()
+        self.caller = self.make_caller(harness)
+
+        # Quantities and prices are quantized from a table built once from exchange info,
+        # shared by the accounts of the exchange and restored from the checkpoint if fresh enough
+        self.exchange_symbols, self.quantizer = refresh_exchange_symbols(exchange_state, self.api, self.rate_budget)
+
+    def fetch_last_price(self, market):
+        r = self.request('ticker', lambda: self.api.get_ticker(symbol=market), key=('ticker', market))
+        price = r.get('lastPrice', None)
+        return (float(price) if price is not None else None), float(r.get('volume', 0))
+
+    def base_asset(self, market):
+        """Asset bought on `market`, BTC for BTCUSDT"""
+        return self.exchange_symbols.get(market, {}).get('baseAsset', market)
+
+    def fetch_price_range(self, market, since):
+        # At most 1000 trades are returned from `since`, the range misses the later ones on busy markets
+        trades = self.request('agg_trades', lambda: self.api.get_aggregate_trades(
+            symbol=market, startTime=int(since * 1000)))
+        if len(trades) == 0:
+            return None, None
+        prices = [float(_t['p']) for _t in trades]
+        return min(prices), max(prices)
+
+    def sell_limit(self, market, quantity, price):
+        """Place a limit sell and return its order id"""
+        self.order_budget.acquire(1)
+        r = self.request('order', lambda: self.api.order_limit_sell(
+            symbol=market,
+            quantity=self.quantizer.format_qty(market, quantity),
+            price=self.quantizer.format_price(market, price)))
+        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
+            raise Exception("Could not close position on broker: %s" % r)
+        return r.get('orderId')
+
+    def close_volume(self, market, quantity):
+        """Quantity a close order of `quantity` would sell, floored to the LOT_SIZE step"""
+        if market not in self.quantizer:
+            return 0
+        return self.quantizer.quantize_qty(market, quantity)
+
+    def close_payload(self, market, quantity, stop_price):
+        """Close order of `quantity` prepared ahead of the trigger
+
+        The quantity is quantized and formatted once and the order checked against
+        the market filters at `stop_price`, `errors` lists why it would be rejected.
+        """
+        if market not in self.quantizer:
+            return {'symbol': market, 'quantity': None, 'volume': 0, 'errors': ["unknown market %s" % market]}
+        volume = self.close_volume(market, quantity)
+        return {
+            'symbol': market,
+            'quantity': self.quantizer.format_qty(market, quantity),
+            'volume': volume,
+            'errors': check_filters(self.exchange_symbols[market], volume, stop_price),
+        }
+
+    def submit_close(self, payload, price):
+        """Place the limit sell of a prepared close order at `price` and return its order id"""
+        self.order_budget.acquire(1)
+        r = self.request('order', lambda: self.api.order_limit_sell(
+            symbol=payload['symbol'], quantity=payload['quantity'],
+            price=self.quantizer.format_price(payload['symbol'], price)))
+        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
+            raise Exception("Could not close position on broker: %s" % r)
+        return r.get('orderId')
+
+    def get_order(self, market, order_id):
+        r = self.request('get_order', lambda: self.api.get_order(symbol=market, orderId=order_id),
+                         key=('order', order_id))
+        if r.get('orderId', None) != order_id or 'type' not in r:
+            raise Exception("Cannot get order %s: %s" % (order_id, r))
+        return self.order_status(r)
+
+    def open_orders(self, market):
+        """Status of the open orders of `market` keyed by order id, in one request"""
+        return dict((_o['orderId'], self.order_status(_o)) for _o in self.request(
+            'open_orders', lambda: self.api.get_open_orders(symbol=market)))
+
+    def order_status(self, order):
+        return {
+            'price': float(order.get('cummulativeQuoteQty', 0)),
+            'type': '%s_%s' % (order.get('type', 'ND'), order.get('side', 'ND')),
+            'is_open': True if order.get('status', False) in ['PARTIALLY_FILLED', 'PENDING_CANCEL', 'NEW'] else False,
+            'remaining_quantity': float(order.get('origQty', 0)) - float(order.get('executedQty', 0)),
+            'cancel_initiated': order.get('PENDING_CANCEL', False),
+            # @TODO: Will not calculate commission with Binance because of BNB fees complexity
+            'commission_paid': 0,
+        }
+
+    def trades_commission(self, market, order_id):
+        """Commission taken on the bought asset by the trades of `order_id`"""
+        commission = 0
+        for trade in self.request('my_trades', lambda: self.api.get_my_trades(symbol=market, orderId=order_id),
+                                  key=('trades', order_id)):
+            commission += float(trade.get('commission', 0))
+        return commission
+
+
+BROKERS = {
+    'bittrex': BittrexBroker,
+    'binance': BinanceBroker,
+}
+
+
+def make_broker(account, state, price_cache=None, price_max_age=None, harness=None):
+    """Broker of `account`, exchange wide data is kept in state['exchanges'][<exchange>]"""
+    if account['exchange'] not in BROKERS:
+        raise NotImplementedError
+    exchange_state = state.setdefault('exchanges', {}).setdefault(account['exchange'], {})
+    broker = BROKERS[account['exchange']](account, exchange_state, harness)
+    broker.price_cache = price_cache
+    if price_max_age is not None:
+        broker.price_max_age = price_max_age
+    return broker
@@ -0,0 +1,80 @@
+"""
+Warm state snapshots and loop supervision
+
+A loop keeps its warm state (exchange info, last prices, scheduler position ...)
+in a dict that is periodically pickled to a local snapshot file and restored on
+start. `supervise` restarts a failed loop with an exponential backoff instead of
+letting the process exit, the state dict surviving in memory across restarts.
+
+Threads changing the state while another one saves it hold `checkpoint.lock`,
+a dict cannot be pickled while it changes size.
+"""
+import os
+import pickle
+import threading
+import time
+import datetime as dt
+
+VERSION = 1
+
+
+class Checkpoint(object):
+    def __init__(self, path, interval=30):
+        self.path = path
+        self.interval = interval
+        self.saved_at = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Return the snapshot state, an empty state if there is none or it is unreadable"""
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('version') != VERSION:
+                return {}
+            print("%s - Restored state from %s (saved at %s)" % (
+                dt.datetime.now(), self.path, dt.datetime.fromtimestamp(snapshot['saved_at'])))
+            return snapshot['state']
+        except Exception as e:
+            print("%s - Ignoring unreadable checkpoint %s: %s" % (dt.datetime.now(), self.path, e))
+            return {}
+
+    def save(self, state):
+        if self.path is None:
+            return
+        with self.lock:
+            snapshot = pickle.dumps({'version': VERSION, 'saved_at': time.time(), 'state': state},
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+        # Write then rename, a crash while saving keeps the previous snapshot
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.path)
+        self.saved_at = time.monotonic()
+
+    def maybe_save(self, state):
+        """Save `state` if the last snapshot is older than `interval` seconds"""
+        if time.monotonic() - self.saved_at >= self.interval:
+            try:
+                self.save(state)
+            except Exception as e:
+                print("%s - Cannot save checkpoint %s: %s" % (dt.datetime.now(), self.path, e))
+
+
+def supervise(run, name, min_backoff=0.1, max_backoff=30, healthy_after=60):
+    """Call `run()` forever, restarting it with an exponential backoff when it raises"""
+    backoff = min_backoff
+    while True:
+        started_at = time.monotonic()
+        try:
+            run()
+            return
+        except Exception as e:
+            # A loop that ran fine for a while starts over with the shortest backoff
+            if time.monotonic() - started_at > healthy_after:
+                backoff = min_backoff
+            print("%s - %s failed: %s, restarting in %ss" % (dt.datetime.now(), name, e, backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
@@ -0,0 +1,114 @@
+"""
+Single `dumbot` entry point over the bot scripts
+
+    python -m dumbot trail --exchange binance
+    python -m dumbot cancel --order-id 123
+    python -m dumbot startup --budget-ms 300
+
+Each command runs its script as __main__ with the remaining arguments. Only the
+standard library is imported before the command is known, the script imports
+what it needs (the one-shot scripts only once their arguments are parsed, and
+the exchange libraries on use).
+`--timing` prints the time spent before the command started and in total.
+"""
+import os
+import sys
+import time
+import runpy
+
+STARTED_AT = time.perf_counter()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'trail': ('automatic-trailing-stoploss.py', 'Trailing stoploss bot'),
+    'sync': ('update-ing-orders.py', 'Order synchronization bot'),
+    'open': ('open-position.py', 'Open one position or a batch of positions'),
+    'schedule': ('open-position-v2.py', 'Open positions on market_settings schedules'),
+    'scalp': ('scalper.py', 'Scalper bot'),
+    'cancel': ('cancel_ing_order.py', 'Roll back an opening or closing order'),
+    'report': ('reporter.py', 'Push the portfolio report'),
+    'report-assets': ('reporter-assets.py', 'Push the per asset balances report'),
+    'report-closures': ('reporter-closure.py', 'Push the per market closures report'),
+    'prices': ('price-cache.py', 'Feed the host price cache'),
+    'archive': ('archive-positions.py', 'Archive finished positions'),
+    'klines': ('download-klines.py', 'Download historical klines'),
+    'api': ('reporting-api.py', 'Serve the reporting HTTP API'),
+}
+
+# Commands expected to start fast, checked by `dumbot startup`
+ONE_SHOT_COMMANDS = ['cancel', 'open', 'report', 'report-assets', 'report-closures']
+
+
+def usage():
+    lines = ["usage: dumbot [--timing] <command> [<args>]", "", "commands:"]
+    for name, (_script, description) in sorted(COMMANDS.items()):
+        lines.append("  %-16s %s" % (name, description))
+    lines.append("  %-16s %s" % ('startup', 'Measure the start time of the commands'))
+    return '\n'.join(lines)
+
+
+def startup(argv):
+    """Time `dumbot <command> --help` (interpreter start, imports and arguments parsing) of every command"""
+    import argparse
+    import subprocess
+    parser = argparse.ArgumentParser(prog='dumbot startup', description='Measure the start time of the commands')
+    parser.add_argument('--budget-ms', type=float, required=False, default=None,
+                        help='Fail if a one-shot command takes longer to start')
+    parser.add_argument('--runs', type=int, required=False, default=3,
+                        help='Runs per command, the best one is kept')
+    parser.add_argument('commands', nargs='*', default=sorted(COMMANDS.keys()),
+                        help='Commands to measure, defaults to all')
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for name in args.commands:
+        best = None
+        for _run in range(args.runs):
+            started_at = time.perf_counter()
+            r = subprocess.run([sys.executable, '-m', 'dumbot', name, '--help'], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            elapsed = (time.perf_counter() - started_at) * 1000
+            if r.returncode != 0:
+                best = None
+                print("%-16s failed: %s" % (name, r.stderr.decode('utf-8', 'replace').strip().splitlines()[-1:]))
+                break
+            best = elapsed if best is None else min(best, elapsed)
+        if best is None:
+            continue
+        flag = ''
+        if args.budget_ms is not None and name in ONE_SHOT_COMMANDS and best > args.budget_ms:
+            over_budget.append(name)
+            flag = ' over budget'
+        print("%-16s %7.1f ms%s" % (name, best, flag))
+
+    return 1 if len(over_budget) > 0 else 0
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    timing = False
+    if len(argv) > 0 and argv[0] == '--timing':
+        timing = True
+        argv = argv[1:]
+
+    if len(argv) == 0 or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] == 'startup':
+        return startup(argv[1:])
+    if argv[0] not in COMMANDS:
+        print("dumbot: unknown command %s\n\n%s" % (argv[0], usage()), file=sys.stderr)
+        return 2
+
+    script = os.path.join(ROOT, COMMANDS[argv[0]][0])
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    sys.argv = ['dumbot %s' % argv[0]] + argv[1:]
+    if timing:
+        print("dumbot: %s starting after %.1f ms" % (argv[0], (time.perf_counter() - STARTED_AT) * 1000))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        if timing:
+            print("dumbot: %s done after %.1f ms" % (argv[0], (time.perf_counter() - STARTED_AT) * 1000))
+    return 0
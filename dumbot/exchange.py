@@ -0,0 +1,52 @@
+"""
+Exchange metadata helpers
+"""
+import time
+
+from dumbot.quantizer import QuantizerTable
+
+# Exchange info kept in the state is reloaded after EXCHANGE_INFO_TTL seconds
+EXCHANGE_INFO_TTL = 3600
+
+
+def load_exchange_symbols(api):
+    """Return Binance symbols info keyed by symbol, with filters keyed by filterType"""
+    exchange_symbols = {}
+    r = api.get_exchange_info()
+    for symbol in r.get('symbols'):
+        # Rebuild the filters array
+        filters = {}
+        for filter in symbol['filters']:
+            filters[filter['filterType']] = filter
+        symbol['filters'] = filters
+
+        exchange_symbols[symbol.get('symbol')] = symbol
+
+    return exchange_symbols
+
+
+def refresh_exchange_symbols(exchange_state, api, budget=None, quantizer=None):
+    """Return (symbols info, quantizer) of `exchange_state`, reloaded if older than EXCHANGE_INFO_TTL
+
+    `exchange_state` is state['exchanges'][<exchange>], shared by the accounts
+    and restored from the checkpoint. `quantizer` is the one returned by the
+    previous call, rebuilt only when the symbols are reloaded.
+    """
+    if time.time() - exchange_state.get('symbols_at', 0) > EXCHANGE_INFO_TTL:
+        if budget is not None:
+            budget.acquire('exchange_info')
+        exchange_state['symbols'] = load_exchange_symbols(api)
+        exchange_state['symbols_at'] = time.time()
+        quantizer = None
+    if quantizer is None:
+        quantizer = QuantizerTable(exchange_state['symbols'])
+    return exchange_state['symbols'], quantizer
+
+
+def load_last_prices(api):
+    """Return the last price of every Binance symbol in one request"""
+    prices = {}
+    for ticker in api.get_symbol_ticker():
+        prices[ticker['symbol']] = float(ticker['price'])
+
+    return prices
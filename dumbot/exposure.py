@@ -0,0 +1,138 @@
+"""
+Running portfolio totals of the trailing stoploss loops
+
+The stop engine keeps the figures of every open position it evaluates, and the
+totals per market and per asset are adjusted by the change of that position
+only, so publishing them costs the same whatever the number of positions:
+
+    book = ExposureBook()
+    book.update(position_id, 'BTCUSDT', 'BTC', volume, price, open_rate, stop)
+    book.retain(seen_ids)   # forget the positions not open anymore
+    publish(db.exposure, 'binance', 'default', book)
+
+Figures of a position:
+- exposure: volume * last price,
+- unrealized: volume * (last price - open rate),
+- at_stop: volume * stop, the value left if every stop fires.
+
+Figures are in the quote currency of the market, totals and caps assume the
+markets share one (USDT) like the reports do.
+
+Buyers check the optional caps of the `exposure_caps` config key against the
+published totals before placing an order (see ExposureCaps).
+"""
+import datetime as dt
+
+FIGURES = ('positions', 'exposure', 'unrealized', 'at_stop')
+
+
+def empty_row():
+    return dict.fromkeys(FIGURES, 0)
+
+
+class ExposureBook(object):
+    def __init__(self):
+        # position id: (market, asset, figures)
+        self.contributions = {}
+        self.markets = {}
+        self.assets = {}
+
+    def _apply(self, market, asset, figures, sign):
+        for table, key in ((self.markets, market), (self.assets, asset)):
+            row = table.setdefault(key, empty_row())
+            for field, value in zip(FIGURES, figures):
+                row[field] += sign * value
+            # Rows restart from zero once empty, so float rounding never accumulates
+            if row['positions'] <= 0:
+                del table[key]
+
+    def update(self, position_id, market, asset, volume, price, open_rate, stop):
+        """Set the figures of an open position, the totals change by the difference only"""
+        figures = (1, volume * price, volume * (price - open_rate), volume * (stop or 0))
+        previous = self.contributions.get(position_id)
+        if previous is not None:
+            if previous[2] == figures:
+                return
+            self._apply(*previous, sign=-1)
+        self._apply(market, asset, figures, 1)
+        self.contributions[position_id] = (market, asset, figures)
+
+    def remove(self, position_id):
+        previous = self.contributions.pop(position_id, None)
+        if previous is not None:
+            self._apply(*previous, sign=-1)
+
+    def retain(self, position_ids):
+        """Remove the positions not in `position_ids` (closed or closing since the last cycle)"""
+        for position_id in [_id for _id in self.contributions if _id not in position_ids]:
+            self.remove(position_id)
+
+    def total(self):
+        total = empty_row()
+        for row in self.markets.values():
+            for field in FIGURES:
+                total[field] += row[field]
+        return total
+
+
+def publish(collection, exchange, account_name, book):
+    """Replace the exposure document of an account with the totals of `book`"""
+    collection.replace_one({'_id': '%s/%s' % (exchange, account_name)}, {
+        'exchange': exchange,
+        'account': account_name,
+        'markets': book.markets,
+        'assets': book.assets,
+        'total': book.total(),
+        'updated_at': dt.datetime.utcnow(),
+    }, upsert=True)
+
+
+class ExposureCaps(object):
+    """Exposure caps in quote currency, from the `exposure_caps` config key
+
+        exposure_caps:
+          total: 10000
+          assets:
+            BTC: 2000
+          markets:
+            ETHUSDT: 500
+
+    Caps apply to the sum of the exposure published by every account of the exchange.
+    """
+    def __init__(self, config):
+        config = config or {}
+        self.total = config.get('total', None)
+        self.assets = config.get('assets', None) or {}
+        self.markets = config.get('markets', None) or {}
+
+    @property
+    def enabled(self):
+        return self.total is not None or len(self.assets) > 0 or len(self.markets) > 0
+
+    def exceeded(self, documents, market, asset, amount, planned=()):
+        """Reason why buying `amount` more of `market` would exceed a cap, None if within the caps
+
+        `documents` are the published exposure documents of the exchange and
+        `planned` lists the (market, asset, amount) bought since they were published.
+        """
+        checks = [('total', None, self.total,
+                   lambda _d: (_d.get('total') or {}).get('exposure', 0),
+                   lambda _m, _a: True)]
+        if market in self.markets:
+            checks.append(('market', market, self.markets[market],
+                           lambda _d: (_d.get('markets') or {}).get(market, {}).get('exposure', 0),
+                           lambda _m, _a: _m == market))
+        if asset in self.assets:
+            checks.append(('asset', asset, self.assets[asset],
+                           lambda _d: (_d.get('assets') or {}).get(asset, {}).get('exposure', 0),
+                           lambda _m, _a: _a == asset))
+
+        for scope, name, cap, published, matches in checks:
+            if cap is None:
+                continue
+            exposure = sum(published(_d) for _d in documents) + \
+                sum(_amount for _m, _a, _amount in planned if matches(_m, _a))
+            if exposure + amount > cap:
+                return "%s exposure %.2f + %.2f over cap %s" % (
+                    '%s %s' % (scope, name) if name is not None else scope, exposure, amount, cap)
+        return None
@@ -0,0 +1,141 @@
+"""
+Historical klines download and local columnar store
+
+Klines are stored per market, interval and UTC month as compressed NumPy
+archives with one array per column:
+
+    <directory>/<market>/<interval>/<YYYY-MM>.npz
+"""
+import os
+import glob
+import json
+import time
+import datetime as dt
+import urllib.parse
+import urllib.request
+import urllib.error
+import numpy as np
+
+BINANCE_URL = 'https://api.binance.com'
+LIMIT = 1000
+
+# Columns of a Binance kline, in api order
+COLUMNS = [
+    ('open_time', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+    ('close_time', np.int64),
+    ('quote_volume', np.float64),
+    ('trades', np.int64),
+    ('taker_buy_volume', np.float64),
+    ('taker_buy_quote_volume', np.float64),
+]
+
+
+def fetch_klines(symbol, interval, start_ms, end_ms, base_url=BINANCE_URL, rate_budget=None, retries=5):
+    """One page (up to LIMIT klines) of /api/v3/klines starting at `start_ms`"""
+    query = urllib.parse.urlencode({
+        'symbol': symbol, 'interval': interval, 'startTime': start_ms, 'endTime': end_ms, 'limit': LIMIT})
+    url = '%s/api/v3/klines?%s' % (base_url.rstrip('/'), query)
+
+    for attempt in range(retries):
+        if rate_budget is not None:
+            rate_budget.acquire('klines')
+        try:
+            with urllib.request.urlopen(url, timeout=30) as r:
+                return json.loads(r.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            # Rate limited (429) or banned (418): wait as told by the exchange
+            if e.code not in (418, 429) or attempt == retries - 1:
+                raise
+            time.sleep(float(e.headers.get('Retry-After', 2 ** attempt)))
+        except urllib.error.URLError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def to_columns(klines):
+    return dict((name, np.array([k[i] for k in klines], dtype=dtype)) for i, (name, dtype) in enumerate(COLUMNS))
+
+
+class KlineStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, market, interval, month):
+        return os.path.join(self.directory, market, interval, '%s.npz' % month)
+
+    def months(self, market, interval):
+        return sorted(os.path.basename(p)[:-4] for p in glob.glob(self.path(market, interval, '*'))
+                      if not p.endswith('.tmp.npz'))
+
+    def load(self, market, interval, month):
+        path = self.path(market, interval, month)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return dict((name, data[name]) for name, _dtype in COLUMNS)
+
+    def last_open_time(self, market, interval):
+        """Open time (ms) of the last stored kline, None if nothing is stored"""
+        months = self.months(market, interval)
+        if len(months) == 0:
+            return None
+        data = self.load(market, interval, months[-1])
+        return int(data['open_time'][-1]) if len(data['open_time']) > 0 else None
+
+    def append(self, market, interval, klines):
+        """Merge `klines` (api rows) into the month files, dropping duplicates"""
+        by_month = {}
+        for k in klines:
+            month = dt.datetime.utcfromtimestamp(k[0] / 1000).strftime('%Y-%m')
+            by_month.setdefault(month, []).append(k)
+
+        for month, rows in by_month.items():
+            columns = to_columns(rows)
+            stored = self.load(market, interval, month)
+            if stored is not None:
+                columns = dict((name, np.concatenate([stored[name], columns[name]])) for name, _dtype in COLUMNS)
+            # Keep the latest download of a kline (the last stored one may have been still open)
+            _times, index = np.unique(columns['open_time'][::-1], return_index=True)
+            keep = len(columns['open_time']) - 1 - index
+            columns = dict((name, values[keep]) for name, values in columns.items())
+
+            path = self.path(market, interval, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so an interrupted download never leaves a corrupted month
+            tmp_path = path[:-4] + '.tmp.npz'
+            np.savez_compressed(tmp_path, **columns)
+            os.replace(tmp_path, path)
+
+
+def download(store, market, interval, since_ms, until_ms=None, base_url=BINANCE_URL, rate_budget=None):
+    """Download `market` klines from the last stored one (or `since_ms`) up to `until_ms`"""
+    until_ms = until_ms or int(time.time() * 1000)
+    last = store.last_open_time(market, interval)
+    start_ms = since_ms if last is None else last
+
+    count = 0
+    buffer = []
+    while start_ms < until_ms:
+        klines = fetch_klines(market, interval, start_ms, until_ms, base_url=base_url, rate_budget=rate_budget)
+        if not klines:
+            break
+        buffer.extend(klines)
+        count += len(klines)
+        start_ms = klines[-1][0] + 1
+
+        # Persist every ~10 pages, a restart resumes from there
+        if len(buffer) >= 10 * LIMIT:
+            store.append(market, interval, buffer)
+            buffer = []
+        if len(klines) < LIMIT:
+            break
+
+    if len(buffer) > 0:
+        store.append(market, interval, buffer)
+    return count
@@ -0,0 +1,95 @@
+"""
+Position opening helpers shared by the opening scripts (binance specific)
+"""
+import datetime as dt
+import time
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from dumbot.accounts import DEFAULT_ACCOUNT
+
+
+def check_filters(market_info, quantity, price):
+    """Return the list of filters an order of `quantity` at `price` would be rejected for"""
+    errors = []
+    market_filters = market_info['filters']
+
+    if market_info.get('status', 'TRADING') != 'TRADING':
+        errors.append("market status is %s" % market_info.get('status'))
+
+    if 'LOT_SIZE' in market_filters:
+        _f = market_filters['LOT_SIZE']
+        if quantity < float(_f['minQty']):
+            errors.append("LOT_SIZE: quantity %s < minQty %s" % (quantity, _f['minQty']))
+        if float(_f['maxQty']) > 0 and quantity > float(_f['maxQty']):
+            errors.append("LOT_SIZE: quantity %s > maxQty %s" % (quantity, _f['maxQty']))
+
+    if 'PRICE_FILTER' in market_filters:
+        _f = market_filters['PRICE_FILTER']
+        if float(_f['minPrice']) > 0 and price < float(_f['minPrice']):
+            errors.append("PRICE_FILTER: price %s < minPrice %s" % (price, _f['minPrice']))
+        if float(_f['maxPrice']) > 0 and price > float(_f['maxPrice']):
+            errors.append("PRICE_FILTER: price %s > maxPrice %s" % (price, _f['maxPrice']))
+
+    for _name in ['MIN_NOTIONAL', 'NOTIONAL']:
+        if _name in market_filters and quantity * price < float(market_filters[_name]['minNotional']):
+            errors.append("%s: notional %s < minNotional %s" % (
+                _name, quantity * price, market_filters[_name]['minNotional']))
+
+    return errors
+
+
+def opening_document(market, open_order_id, broker, rate, quantity, hodl=False, account=DEFAULT_ACCOUNT):
+    """Position document inserted once the opening order is placed"""
+    _doc = {
+        "account": account,
+        "open_at": dt.datetime.utcnow(),
+        "status": "opening",
+        "market": market,
+        "open_order_id": open_order_id,
+        "broker": broker,
+        "open_rate": rate,
+        "volume": quantity,
+        "current_price": rate,
+        "price_at": dt.datetime.utcnow(),
+        'last_update_at': dt.datetime.utcnow(),
+    }
+
+    # Shall we hodl this position ?
+    if hodl:
+        _doc['hodl'] = True
+
+    return _doc
+
+
+def record_positions(collection, docs, retries=3, retry_delay=1):
+    """Insert the documents of placed orders, return the documents that could not be recorded
+
+    insert_many sets the _id of the documents before sending them, so the ones
+    that failed are inserted again one by one and a duplicate key means it was
+    recorded by an earlier attempt.
+    """
+    try:
+        collection.insert_many(docs, ordered=False)
+        return []
+    except BulkWriteError as e:
+        failed = [docs[_e['index']] for _e in e.details.get('writeErrors', []) if _e.get('code') != 11000]
+    except PyMongoError as e:
+        print("%s - Could not record %s position(s), retrying one by one: %s" % (dt.datetime.now(), len(docs), e))
+        failed = list(docs)
+
+    for _attempt in range(retries):
+        if len(failed) == 0:
+            break
+        if _attempt > 0:
+            time.sleep(retry_delay)
+        remaining = []
+        for _doc in failed:
+            try:
+                collection.insert_one(_doc)
+            except DuplicateKeyError:
+                pass
+            except PyMongoError:
+                remaining.append(_doc)
+        failed = remaining
+    return failed
@@ -0,0 +1,58 @@
+"""
+Next check time of the pending orders polled by update-ing-orders.py
+
+A fresh order is checked every `min_interval` seconds, then less often as it
+rests on the book: the interval grows by `backoff` seconds per second of age,
+up to `max_interval`. An order whose market trades within `proximity` percent
+of its price is likely to fill and goes back to `min_interval` at once.
+
+    schedule = PollSchedule(min_interval=5, max_interval=120, backoff=0.1, proximity=0.5)
+    near = schedule.near(order_rate, last_price)
+    if schedule.due(order_id, near):
+        ...check the order...
+        schedule.checked(order_id, age, near)
+"""
+import threading
+import time
+
+
+class PollSchedule(object):
+    def __init__(self, min_interval=5, max_interval=120, backoff=0.1, proximity=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.proximity = proximity
+        # order id: (last check time, next check time)
+        self.checks = {}
+        self._lock = threading.Lock()
+
+    def near(self, order_rate, price):
+        """Is `price` within `proximity` percent of the order price"""
+        if not order_rate or price is None:
+            return False
+        return abs(price - order_rate) * 100 / order_rate <= self.proximity
+
+    def interval(self, age, near=False):
+        if near:
+            return min(self.min_interval, self.max_interval)
+        return min(self.max_interval, max(self.min_interval, (age or 0) * self.backoff))
+
+    def due(self, order_id, near=False, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            checked_at, next_check_at = self.checks.get(order_id, (None, None))
+        if next_check_at is None or now >= next_check_at:
+            return True
+        # Snap back when the price comes close, without waiting for the backed off check
+        return near and now - checked_at >= self.interval(0, near)
+
+    def checked(self, order_id, age, near=False, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            self.checks[order_id] = (now, now + self.interval(age, near))
+
+    def retain(self, order_ids):
+        """Forget the orders not in `order_ids` (not pending anymore)"""
+        with self._lock:
+            for order_id in [_id for _id in self.checks if _id not in order_ids]:
+                del self.checks[order_id]
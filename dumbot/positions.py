@@ -0,0 +1,54 @@
+"""
+Compact position records for the trading loops
+
+Positions are fetched with a projection of the fields a loop needs and kept as
+raw BSON until first accessed, then decoded once into a __slots__ object, so
+a book of tens of thousands of positions costs no per-document dict.
+"""
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+# Fields read by automatic-trailing-stoploss.py
+TRAILING_FIELDS = ('market', 'volume', 'open_rate', 'stop_loss', 'hodl', 'current_price', 'close_payload')
+
+# Fields read by update-ing-orders.py
+SYNC_FIELDS = ('market', 'status', 'volume', 'open_order_id', 'close_order_id', 'paid_commission',
+               'open_cost_proceeds', 'remaining_volume', 'current_price', 'close_group_volume',
+               'open_at', 'open_rate', 'closed_at', 'close_rate', 'close_volume', 'close_claimed_by',
+               'close_claimed_at')
+
+FIELDS = tuple(sorted(set(TRAILING_FIELDS + SYNC_FIELDS)))
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument, tz_aware=False)
+
+
+class Position(object):
+    __slots__ = ('id', '_raw') + FIELDS
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        # Only called for slots not decoded yet
+        raw = object.__getattribute__(self, '_raw')
+        if raw is None or (name != 'id' and name not in FIELDS):
+            raise AttributeError(name)
+
+        document = bson.decode(raw)
+        self.id = document.get('_id')
+        for field in FIELDS:
+            setattr(self, field, document.get(field))
+        self._raw = None
+        return getattr(self, name)
+
+    def __repr__(self):
+        return '<Position %s %s (%s)>' % (self.id, self.market, self.status)
+
+
+def find_positions(collection, query, fields):
+    """Iterate over the positions matching `query`, fetching `fields` only"""
+    projection = dict((field, True) for field in fields)
+    raw_collection = collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+    for document in raw_collection.find(query, projection):
+        yield Position(document.raw)
@@ -0,0 +1,260 @@
+"""
+Host-local shared price cache
+
+One feed process (price-cache.py) writes the last price of every market of an
+exchange into a shared memory file, every bot of the host reads it instead of
+requesting tickers:
+
+    cache = PriceCache.open('/dev/shm/dumbot-binance.prices')
+    price, at = cache.get('BTCUSDT')          # at: epoch seconds of the update
+    price = cache.price('BTCUSDT', max_age=5) # None if missing or older
+    low, high = cache.range('BTCUSDT', since, max_age=5)
+
+Each slot also keeps the low and high of the last RING_SIZE updates of its
+market in a ring buffer, so a reader polling every few seconds still sees the
+extremes reached between two of its reads (`range`), as long as the ring still
+holds the update before its previous read. The Binance feed fills the ring from
+the 1s klines, the traded low and high of every second.
+
+The file is a fixed size header followed by one slot per market. Writes are
+wrapped in a sequence counter (odd while writing), readers retry a read that
+overlapped a write, so no lock is shared between processes. A sequence left
+odd by a feed killed while writing reads as missing after READ_TIMEOUT, the
+bots then request the exchange.
+"""
+import os
+import threading
+import time
+import numpy as np
+
+MAGIC = b'DUMBOTPC'
+VERSION = 3
+DEFAULT_CAPACITY = 8192
+# Updates kept per market, about a minute of 1s klines (the default wick lookback)
+RING_SIZE = 64
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('capacity', '<u4'),
+                         ('count', '<u4'), ('pad', '<u4'), ('seq', '<u8'), ('updated_at', '<f8')])
+SLOT_DTYPE = np.dtype([('symbol', 'S16'), ('price', '<f8'), ('volume', '<f8'), ('ts', '<f8'), ('head', '<u8'),
+                       ('ring_ts', '<f8', (RING_SIZE,)), ('ring_low', '<f8', (RING_SIZE,)),
+                       ('ring_high', '<f8', (RING_SIZE,))])
+
+
+def default_path(exchange):
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    return os.path.join(directory, 'dumbot-%s.prices' % exchange)
+
+
+def cache_path(config, exchange):
+    """Cache file of `exchange`, from the `price_cache` config key (a path per exchange) or the default one"""
+    return (config.get('price_cache', None) or {}).get(exchange, None) or default_path(exchange)
+
+
+class PriceCacheWriter(object):
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        size = HEADER_DTYPE.itemsize + capacity * SLOT_DTYPE.itemsize
+        # Always start from an empty table, initialized before being renamed so readers never see it blank
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.truncate(size)
+
+        self.path = path
+        self.header = np.memmap(tmp_path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        self.slots = np.memmap(tmp_path, dtype=SLOT_DTYPE, mode='r+', offset=HEADER_DTYPE.itemsize,
+                               shape=(capacity,))
+        self.header['magic'] = MAGIC
+        self.header['version'] = VERSION
+        self.header['capacity'] = capacity
+        self.header.flush()
+        os.replace(tmp_path, path)
+        self.index = {}
+        # Feeds may write from several stream threads, the sequence counter needs one writer at a time
+        self._lock = threading.Lock()
+
+    def update(self, prices, ts=None, ring=True):
+        """Write `prices` {symbol: price}, {symbol: (price, volume)} or {symbol: (price, volume, low, high)}
+
+        `low` and `high` are the extremes traded since the previous update of
+        the symbol, they default to the price. A None volume keeps the current
+        one. With `ring` False the range ring is left to another stream.
+        """
+        with self._lock:
+            self._update(prices, ts if ts is not None else time.time(), ring)
+
+    def _update(self, prices, ts, ring):
+        header = self.header[0]
+        header['seq'] += 1
+        try:
+            for symbol, price in prices.items():
+                price, volume, low, high = (tuple(price) + (None, None))[:4] if isinstance(price, tuple) \
+                    else (price, 0, None, None)
+                slot = self.index.get(symbol)
+                if slot is None:
+                    if len(self.index) >= len(self.slots):
+                        continue
+                    slot = self.index[symbol] = len(self.index)
+                    self.slots[slot]['symbol'] = symbol.encode('ascii')
+                    header['count'] = len(self.index)
+                entry = self.slots[slot]
+                entry['price'] = price
+                if volume is not None:
+                    entry['volume'] = volume
+                entry['ts'] = ts
+                if ring:
+                    i = int(entry['head']) % RING_SIZE
+                    entry['ring_ts'][i] = ts
+                    entry['ring_low'][i] = low if low is not None else price
+                    entry['ring_high'][i] = high if high is not None else price
+                    entry['head'] += 1
+            header['updated_at'] = ts
+        finally:
+            header['seq'] += 1
+
+    def close(self):
+        self.header.flush()
+        del self.header, self.slots
+
+
+class PriceCache(object):
+    # Seconds between checks that the feed did not restart with a new file
+    REOPEN_CHECK = 1
+    # Seconds a read waits for a write to complete before giving up
+    READ_TIMEOUT = 0.05
+
+    def __init__(self, path):
+        self.path = path
+        self._map()
+
+    def _map(self):
+        self.inode = os.stat(self.path).st_ino
+        self.checked_at = time.time()
+        self.header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r', shape=(1,))
+        if self.header['magic'][0] != MAGIC or self.header['version'][0] != VERSION:
+            raise Exception("%s is not a price cache file" % self.path)
+        self.slots = np.memmap(self.path, dtype=SLOT_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize,
+                               shape=(int(self.header['capacity'][0]),))
+        self.index = {}
+        self.count = 0
+        # Odd sequence a read gave up on, the next reads do not wait for it again
+        self.stalled_seq = None
+
+    @classmethod
+    def open(cls, path):
+        """Reader of the cache at `path`, None if no feed ever wrote it"""
+        try:
+            return cls(path)
+        except (OSError, ValueError):
+            return None
+        except Exception as e:
+            print("Price cache unavailable: %s" % e)
+            return None
+
+    def _reindex(self, count):
+        if count < self.count:
+            self.index = {}
+            self.count = 0
+        for slot in range(self.count, count):
+            self.index[self.slots[slot]['symbol'].decode('ascii')] = slot
+        self.count = count
+
+    def _reopen(self):
+        """Map the file again if the feed restarted with a new one, return True if it did"""
+        self.checked_at = time.time()
+        try:
+            if os.stat(self.path).st_ino != self.inode:
+                self._map()
+                return True
+        except OSError:
+            # Feed is restarting, keep reading the last values
+            pass
+        return False
+
+    def _read(self, read, default=None):
+        """Return `read()` once it did not overlap a write, `default` if the writes never complete"""
+        if time.time() - self.checked_at > self.REOPEN_CHECK:
+            self._reopen()
+
+        deadline = time.monotonic() + self.READ_TIMEOUT
+        while True:
+            header = self.header[0]
+            seq = int(header['seq'])
+            if seq == self.stalled_seq:
+                return default
+            if seq % 2 == 0:
+                count = int(header['count'])
+                if count != self.count:
+                    self._reindex(count)
+                value = read()
+                if int(header['seq']) == seq:
+                    return value
+            if time.monotonic() > deadline:
+                # The feed may have died while writing and been restarted with a new file
+                if not self._reopen():
+                    self.stalled_seq = seq if seq % 2 == 1 else None
+                    return default
+                deadline = time.monotonic() + self.READ_TIMEOUT
+            time.sleep(0)
+
+    def get(self, market):
+        """Return (price, update epoch seconds) of `market`, (None, None) if not in the cache"""
+        def read():
+            slot = self.index.get(market)
+            if slot is None:
+                return None, None
+            return float(self.slots[slot]['price']), float(self.slots[slot]['ts'])
+        return self._read(read, (None, None))
+
+    def price(self, market, max_age):
+        """Price of `market` if updated in the last `max_age` seconds, None otherwise"""
+        price, at = self.get(market)
+        if price is None or time.time() - at > max_age:
+            return None
+        return price
+
+    def quote(self, market, max_age):
+        """(price, volume) of `market` if updated in the last `max_age` seconds, (None, 0) otherwise"""
+        def read():
+            slot = self.index.get(market)
+            if slot is None:
+                return None, 0, 0
+            return float(self.slots[slot]['price']), float(self.slots[slot]['volume']), float(self.slots[slot]['ts'])
+        price, volume, at = self._read(read, (None, 0, 0))
+        if price is None or time.time() - at > max_age:
+            return None, 0
+        return price, volume
+
+    def range(self, market, since, max_age):
+        """(low, high) of `market` over the updates after epoch `since`, (None, None) if none or stale
+
+        Only the last RING_SIZE updates are kept, a `since` older than the
+        oldest of them gets (None, None) too, the caller requests the range
+        from the exchange instead of missing the extremes dropped from the ring.
+        """
+        def read():
+            slot = self.index.get(market)
+            if slot is None:
+                return None
+            return self.slots[slot].copy()
+        entry = self._read(read)
+        if entry is None or time.time() - float(entry['ts']) > max_age:
+            return None, None
+        head = int(entry['head'])
+        oldest = entry['ring_ts'][head % RING_SIZE] if head >= RING_SIZE else entry['ring_ts'][0]
+        if head == 0 or oldest > since:
+            return None, None
+        recent = entry['ring_ts'] > since
+        if not recent.any():
+            return None, None
+        return float(entry['ring_low'][recent].min()), float(entry['ring_high'][recent].max())
+
+    def prices(self, max_age):
+        """{symbol: price} of every market updated in the last `max_age` seconds"""
+        slots = self._read(lambda: np.array(self.slots[:self.count]))
+        if slots is None:
+            return {}
+        fresh = slots['ts'] >= time.time() - max_age
+        return dict((s.decode('ascii'), float(p)) for s, p in zip(slots['symbol'][fresh], slots['price'][fresh]))
+
+    @property
+    def updated_at(self):
+        return float(self.header['updated_at'][0])
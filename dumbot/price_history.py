@@ -0,0 +1,78 @@
+"""
+Downsampled per-market price history
+
+Prices observed by the bots are aggregated per market over `interval` seconds
+and written as one point per market and interval to the `price_history`
+collection (a MongoDB time series when the server supports it):
+
+    {'at': <interval start>, 'market': 'BTCUSDT', 'broker': 'binance',
+     'price': <last>, 'low': <min>, 'high': <max>}
+
+Reporters and charts should read prices from there, not from `positions`.
+"""
+import threading
+import datetime as dt
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+
+def ensure_collection(db, name='price_history'):
+    """Create the price history time series collection if missing"""
+    if name in db.list_collection_names():
+        return db[name]
+
+    try:
+        db.create_collection(name, timeseries={'timeField': 'at', 'metaField': 'market', 'granularity': 'minutes'})
+    except PyMongoError:
+        # Time series need MongoDB >= 5.0, fallback to a regular indexed collection
+        db[name].create_index([('market', ASCENDING), ('at', ASCENDING)])
+    return db[name]
+
+
+def changed(old, new, epsilon):
+    """True if `new` differs from `old` by more than `epsilon` (relative)"""
+    if old is None or new is None:
+        return old is not new
+    return abs(new - old) > abs(old) * epsilon
+
+
+class PriceHistory(object):
+    def __init__(self, db, broker, interval=60):
+        self.collection = ensure_collection(db)
+        self.broker = broker
+        self.interval = interval
+        self.points = {}
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def observe(self, market, price, at=None):
+        at = at or dt.datetime.utcnow()
+        bucket = at.replace(microsecond=0) - dt.timedelta(
+            seconds=int((at - dt.datetime(1970, 1, 1)).total_seconds()) % self.interval)
+
+        with self._lock:
+            point = self.points.get(market)
+            if point is None or point['at'] != bucket:
+                if point is not None and not point['written']:
+                    self.pending.append(point)
+                point = self.points[market] = {'at': bucket, 'market': market, 'broker': self.broker,
+                                               'price': price, 'low': price, 'high': price, 'written': False}
+            else:
+                point['price'] = price
+                point['low'] = min(point['low'], price)
+                point['high'] = max(point['high'], price)
+
+    def flush(self, now=None):
+        """Write the points of the intervals that are over"""
+        now = now or dt.datetime.utcnow()
+        with self._lock:
+            docs = [dict((k, v) for k, v in point.items() if k != 'written') for point in self.pending]
+            self.pending = []
+            for market, point in list(self.points.items()):
+                if not point['written'] and point['at'] + dt.timedelta(seconds=self.interval) <= now:
+                    point['written'] = True
+                    docs.append(dict((k, v) for k, v in point.items() if k != 'written'))
+
+        if len(docs) > 0:
+            self.collection.insert_many(docs, ordered=False)
+        return len(docs)
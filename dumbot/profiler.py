@@ -0,0 +1,175 @@
+"""
+Runtime toggled sampling profiler for the bot loops
+
+Loops mark their cycles, the profiler samples the stacks of the threads inside
+a cycle while enabled and costs a couple of clock reads per cycle otherwise.
+
+    profiler = SamplingProfiler('profiles').start()
+    while True:
+        profiler.begin_cycle()
+        ...
+        profiler.end_cycle(positions=count)
+
+Work handed to a pool is sampled under the cycle of the thread handing it over:
+
+    owner = threading.get_ident()
+    executor.submit(profiler.run_in_cycle, owner, fn, *args)
+
+Profiling is switched on and off with SIGUSR1 or by creating and removing
+<directory>/ENABLED. When switched off (or closed while on), it writes to
+<directory>/<pid>-<time>/:
+
+- all.folded: stacks of every sampled cycle, in the collapsed format read by
+  flamegraph.pl and speedscope ("frame;frame;frame count" lines),
+- slowest.txt: the slowest cycles with their duration and position count,
+- slowest-<rank>.folded: the stacks of each of those cycles.
+"""
+import os
+import sys
+import heapq
+import signal
+import threading
+import time
+import collections
+import datetime as dt
+
+CONTROL_FILE = 'ENABLED'
+
+
+def collapse(frame):
+    """Collapsed stack of `frame`, outermost frame first"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class SamplingProfiler(object):
+    def __init__(self, directory, interval=0.005, slowest=10):
+        self.directory = directory
+        self.interval = interval
+        self.slowest = slowest
+        self.enabled = False
+        self.toggled = False
+        self.cycles = {}
+        # Pool thread ident: ident of the thread whose cycle it works for
+        self.helpers = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.stacks = collections.Counter()
+        self.slowest_cycles = []
+        self.cycle_count = 0
+        self.enabled_at = time.time()
+
+    def start(self):
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._on_signal)
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _on_signal(self, signum, frame):
+        self.toggled = not self.toggled
+
+    def _set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        if enabled:
+            with self._lock:
+                self._reset()
+            print("%s - Profiler enabled" % dt.datetime.now())
+        self.enabled = enabled
+        if not enabled:
+            print("%s - Profiler disabled, written to %s" % (dt.datetime.now(), self.dump()))
+
+    def _run(self):
+        checked_at = 0
+        while True:
+            # Control file checked once per second
+            if time.time() - checked_at > 1:
+                checked_at = time.time()
+                self._set_enabled(self.toggled or os.path.exists(os.path.join(self.directory, CONTROL_FILE)))
+            if not self.enabled:
+                time.sleep(0.2)
+                continue
+
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, cycle in self.cycles.items():
+                    if ident in frames:
+                        cycle['stacks'][collapse(frames[ident])] += 1
+                for ident, owner in self.helpers.items():
+                    if ident in frames and owner in self.cycles:
+                        self.cycles[owner]['stacks'][collapse(frames[ident])] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def begin_cycle(self):
+        with self._lock:
+            self.cycles[threading.get_ident()] = {
+                'thread': threading.current_thread().name,
+                'started_at': time.time(),
+                'stacks': collections.Counter(),
+            }
+
+    def run_in_cycle(self, owner, fn, *args):
+        """Call `fn(*args)`, sampled as part of the cycle of thread `owner`"""
+        ident = threading.get_ident()
+        with self._lock:
+            self.helpers[ident] = owner
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.helpers.pop(ident, None)
+
+    def end_cycle(self, positions=0):
+        with self._lock:
+            cycle = self.cycles.pop(threading.get_ident(), None)
+            if cycle is None or not self.enabled:
+                return
+            cycle['duration'] = time.time() - cycle['started_at']
+            cycle['positions'] = positions
+            self.cycle_count += 1
+            self.stacks.update(cycle['stacks'])
+
+            # Keep the slowest cycles in a min heap
+            entry = (cycle['duration'], self.cycle_count, cycle)
+            if len(self.slowest_cycles) < self.slowest:
+                heapq.heappush(self.slowest_cycles, entry)
+            elif entry[0] > self.slowest_cycles[0][0]:
+                heapq.heapreplace(self.slowest_cycles, entry)
+
+    def close(self):
+        """Write the profile being gathered, if any, before exiting"""
+        if self.enabled:
+            self._set_enabled(False)
+
+    def dump(self):
+        """Write the profile gathered since enabled, return its directory"""
+        with self._lock:
+            stacks = self.stacks
+            slowest_cycles = sorted(self.slowest_cycles, reverse=True)
+            cycle_count = self.cycle_count
+
+        path = os.path.join(self.directory, '%s-%s' % (os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, 'all.folded'), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+        with open(os.path.join(path, 'slowest.txt'), 'w') as f:
+            f.write("%d cycles profiled in %.1fs\n\n" % (cycle_count, time.time() - self.enabled_at))
+            f.write("rank duration(s) positions thread started_at\n")
+            for rank, (duration, _n, cycle) in enumerate(slowest_cycles, 1):
+                f.write("%d %.3f %d %s %s\n" % (rank, duration, cycle['positions'], cycle['thread'],
+                                                dt.datetime.fromtimestamp(cycle['started_at'])))
+                with open(os.path.join(path, 'slowest-%d.folded' % rank), 'w') as fc:
+                    for stack, count in cycle['stacks'].most_common():
+                        fc.write('%s %d\n' % (stack, count))
+
+        return path
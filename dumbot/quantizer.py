@@ -0,0 +1,98 @@
+"""
+Per-symbol quantization of order quantities and prices (binance specific)
+
+LOT_SIZE stepSize and PRICE_FILTER tickSize are parsed once from exchange info
+into integer scales: a quantity is held as a number of 10**-decimals units, so
+stepping it is an integer floor instead of a float modulo that can land one
+step below the requested value. Every method accepts either one symbol and
+one value, or arrays of symbols and values (quantized with numpy).
+"""
+import math
+from decimal import Decimal
+import numpy as np
+
+# Decimals of units kept before flooring: qty * scale carries the float error of both
+# (1.15 * 10**8 is 114999999.99999999), rounding it first floors to 115000000
+UNITS_DECIMALS = 6
+
+
+def _scale(step):
+    """Return (10**decimals, step in units) of a filter step like '0.00100000'"""
+    step = Decimal(str(step)).normalize()
+    decimals = max(0, -step.as_tuple().exponent)
+    return 10 ** decimals, int(step * 10 ** decimals)
+
+
+def _format_units(units, scale):
+    if scale == 1:
+        return '%d' % units
+    return '%d.%0*d' % (units // scale, len(str(scale)) - 1, units % scale)
+
+
+class QuantizerTable(object):
+    def __init__(self, exchange_symbols):
+        """Build the table from symbols info keyed by symbol (see dumbot.exchange.load_exchange_symbols)"""
+        self.index = {}
+        rows = []
+        for symbol, info in exchange_symbols.items():
+            filters = info.get('filters', {})
+            lot_size = filters.get('LOT_SIZE', {})
+            price_filter = filters.get('PRICE_FILTER', {})
+            qty_scale, qty_step = _scale(lot_size.get('stepSize') or '0.00000001')
+            price_scale, price_tick = _scale(price_filter.get('tickSize') or '0.00000001')
+
+            self.index[symbol] = len(rows)
+            rows.append((
+                qty_scale, qty_step or 1,
+                int(round(float(lot_size.get('minQty', 0)) * qty_scale)),
+                int(round(float(lot_size.get('maxQty', 0)) * qty_scale)),
+                price_scale, price_tick or 1,
+            ))
+
+        self.rows = rows
+        table = np.array(rows, dtype=np.int64).reshape(-1, 6)
+        self.qty_scale, self.qty_step, self.qty_min, self.qty_max, self.price_scale, self.price_tick = table.T
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def _qty_units(self, symbol, qty):
+        qty_scale, qty_step, qty_min, _qty_max, _price_scale, _price_tick = self.rows[self.index[symbol]]
+        units = int(math.floor(round(qty * qty_scale, UNITS_DECIMALS)))
+        # LOT_SIZE rule: (quantity - minQty) % stepSize == 0
+        return max(units - (units - qty_min) % qty_step, 0), qty_scale
+
+    def _price_units(self, symbol, price):
+        _qty_scale, _qty_step, _qty_min, _qty_max, price_scale, price_tick = self.rows[self.index[symbol]]
+        return int(round(price * price_scale / price_tick)) * price_tick, price_scale
+
+    def quantize_qty(self, symbol, qty):
+        """Floor `qty` to the LOT_SIZE step of `symbol`"""
+        if isinstance(symbol, str):
+            units, scale = self._qty_units(symbol, qty)
+            return units / scale
+
+        i = np.array([self.index[s] for s in symbol])
+        scale, step, qty_min = self.qty_scale[i], self.qty_step[i], self.qty_min[i]
+        units = np.floor(np.round(np.asarray(qty, dtype=np.float64) * scale, UNITS_DECIMALS)).astype(np.int64)
+        units = np.maximum(units - (units - qty_min) % step, 0)
+        return units / scale
+
+    def quantize_price(self, symbol, price):
+        """Round `price` to the nearest PRICE_FILTER tick of `symbol`"""
+        if isinstance(symbol, str):
+            units, scale = self._price_units(symbol, price)
+            return units / scale
+
+        i = np.array([self.index[s] for s in symbol])
+        scale, tick = self.price_scale[i], self.price_tick[i]
+        units = np.rint(np.asarray(price, dtype=np.float64) * scale / tick).astype(np.int64) * tick
+        return units / scale
+
+    def format_qty(self, symbol, qty):
+        """Quantized `qty` as the exact decimal string sent to the exchange"""
+        return _format_units(*self._qty_units(symbol, qty))
+
+    def format_price(self, symbol, price):
+        """Quantized `price` as the exact decimal string sent to the exchange"""
+        return _format_units(*self._price_units(symbol, price))
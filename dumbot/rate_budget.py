@@ -0,0 +1,68 @@
+"""
+Token bucket shared by the threads of a bot to stay under the exchange rate limits
+
+Binance counts a request weight per minute (1200 by default) and a number of
+orders per 10 seconds, callers `acquire()` the weight of their request before
+sending it and get blocked until the budget allows it.
+"""
+import threading
+import time
+
+# Request weights of the Binance endpoints used by the bots
+WEIGHTS = {
+    'exchange_info': 20,
+    'ticker': 2,
+    'all_tickers': 4,
+    'agg_trades': 2,
+    'order': 1,
+    'get_order': 4,
+    'open_orders': 6,
+    'my_trades': 20,
+    'account': 20,
+    'cancel_order': 1,
+    'klines': 2,
+}
+
+
+class RateBudget(object):
+    def __init__(self, capacity=1200, period=60):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, weight=1):
+        """Block until `weight` tokens are available then consume them"""
+        if isinstance(weight, str):
+            weight = WEIGHTS[weight]
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, weight=1):
+        """Consume `weight` tokens if available right away, never blocks"""
+        if isinstance(weight, str):
+            weight = WEIGHTS[weight]
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= weight:
+                self.tokens -= weight
+                return True
+            return False
+
+
+def binance_budgets():
+    """Request weight budget and order count budget matching Binance spot limits"""
+    return RateBudget(1200, 60), RateBudget(100, 10)
@@ -0,0 +1,265 @@
+"""
+Record and replay of the exchange and MongoDB traffic of a bot
+
+A recording run wraps the exchange clients and the database with proxies that
+append every exchange call and every MongoDB read, with its result, time and
+duration, to a compressed pickle stream. A replay run gets the same proxies
+backed by the recording instead of the network: calls are answered in recorded
+order (per channel and method, matching arguments when possible), writes are
+dropped and no connection is made, so the loop runs over identical input.
+
+    harness = Harness(record='trailing.replay')   # or Harness(replay='trailing.replay', pace=False)
+    db = harness.database(mongo['dumbot'], 'mongo')
+    api = harness.api(lambda: Binance(key, secret), 'binance/default')
+
+At full speed calls return immediately, with `pace` each call takes its recorded
+duration and loop sleeps are kept, reproducing the original pacing. The warm
+state of the recording run is stored in the recording and restored on replay,
+its timestamps (`*_at` keys) shifted to the replay start.
+"""
+import gzip
+import copy
+import pickle
+import threading
+import time
+import collections
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.cursor import Cursor
+from pymongo.command_cursor import CommandCursor
+
+# MongoDB methods whose results are recorded, other methods are writes
+MONGO_READS = ('find', 'find_one', 'find_one_and_update', 'aggregate', 'count_documents',
+               'list_collection_names', 'watch')
+# Methods returning a collection or database handle
+MONGO_HANDLES = ('with_options', 'get_collection')
+# Unconsumed events scanned for matching arguments before taking the oldest one
+MATCH_WINDOW = 64
+
+
+class ReplayFinished(BaseException):
+    """Raised when a replayed loop asks for more than was recorded (not an Exception, so loops stop)"""
+    pass
+
+
+class ReplayError(Exception):
+    pass
+
+
+def _key(args, kwargs):
+    try:
+        return repr((args, sorted(kwargs.items())))
+    except Exception:
+        return None
+
+
+def _shift(state, shift):
+    if isinstance(state, dict):
+        for k, v in state.items():
+            if isinstance(k, str) and k.endswith('_at') and isinstance(v, (int, float)):
+                state[k] = v + shift
+            else:
+                _shift(v, shift)
+
+
+class Recorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'wb')
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        with self._lock:
+            pickle.dump(event, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def record(self, channel, name, args, kwargs, started_at, ok, value):
+        self.write(('call', started_at, time.time() - started_at, channel, name, _key(args, kwargs), ok, value))
+        self.count += 1
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+class Player(object):
+    def __init__(self, path, pace=False):
+        self.pace = pace
+        self.state = None
+        self.recorded_at = None
+        self.queues = collections.defaultdict(list)
+        self.consumed = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+        with gzip.open(path, 'rb') as f:
+            while True:
+                try:
+                    event = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    # A recording interrupted by a crash ends with a partial event
+                    print("Recording %s truncated: %s" % (path, e))
+                    break
+                if event[0] == 'state':
+                    self.recorded_at, self.state = event[1], event[2]
+                    continue
+                _kind, _at, duration, channel, name, key, ok, value = event
+                self.queues[(channel, name)].append([key, duration, ok, value])
+                self.count += 1
+        # Queues are consumed from the front
+        self.queues = dict((k, collections.deque(v)) for k, v in self.queues.items())
+
+    def next(self, channel, name, args, kwargs):
+        with self._lock:
+            queue = self.queues.get((channel, name))
+            if not queue:
+                raise ReplayFinished("no more recorded %s.%s" % (channel, name))
+            key = _key(args, kwargs)
+            for i, event in enumerate(queue):
+                if i >= MATCH_WINDOW:
+                    break
+                if event[0] == key:
+                    del queue[i]
+                    break
+            else:
+                event = queue.popleft()
+            self.consumed += 1
+
+        _key_, duration, ok, value = event
+        if self.pace:
+            time.sleep(duration)
+        if not ok:
+            raise ReplayError(value)
+        return copy.deepcopy(value)
+
+
+class RecordingProxy(object):
+    def __init__(self, target, recorder, channel, reads=None):
+        self._target = target
+        self._recorder = recorder
+        self._channel = channel
+        self._reads = reads
+
+    def _wrap(self, value, channel):
+        if isinstance(value, (Database, Collection)):
+            return RecordingProxy(value, self._recorder, channel, self._reads)
+        return value
+
+    def __getitem__(self, name):
+        return self._wrap(self._target[name], '%s.%s' % (self._channel, name))
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if isinstance(value, (Database, Collection)):
+            return self._wrap(value, '%s.%s' % (self._channel, name))
+        if not callable(value):
+            return value
+        if name in MONGO_HANDLES:
+            return lambda *args, **kwargs: self._wrap(value(*args, **kwargs), self._channel)
+        if self._reads is not None and name not in self._reads:
+            return value
+
+        def call(*args, **kwargs):
+            started_at = time.time()
+            try:
+                result = value(*args, **kwargs)
+                if isinstance(result, (Cursor, CommandCursor)):
+                    result = list(result)
+            except Exception as e:
+                self._recorder.record(self._channel, name, args, kwargs, started_at, False, repr(e))
+                raise
+            self._recorder.record(self._channel, name, args, kwargs, started_at, True, result)
+            return result
+        return call
+
+
+class ReplayProxy(object):
+    def __init__(self, player, channel, reads=None):
+        self._player = player
+        self._channel = channel
+        self._reads = reads
+
+    def __getitem__(self, name):
+        return ReplayProxy(self._player, '%s.%s' % (self._channel, name), self._reads)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in MONGO_HANDLES:
+            return lambda *args, **kwargs: self
+        if self._reads is not None and name not in self._reads:
+            if name in ('insert_one', 'insert_many', 'update_one', 'update_many', 'delete_many',
+                        'bulk_write', 'create_index', 'create_collection', 'replace_one'):
+                # Writes are dropped
+                return lambda *args, **kwargs: None
+            # Collection handle (db.positions)
+            return ReplayProxy(self._player, '%s.%s' % (self._channel, name), self._reads)
+        return lambda *args, **kwargs: self._player.next(self._channel, name, args, kwargs)
+
+
+class Harness(object):
+    """Live, recording or replaying access to the exchanges and the database"""
+    def __init__(self, record=None, replay=None, pace=False):
+        if record is not None and replay is not None:
+            raise Exception("Cannot record and replay at once")
+        self.recorder = Recorder(record) if record is not None else None
+        self.player = Player(replay, pace) if replay is not None else None
+        self.started_at = time.time()
+
+    @property
+    def active(self):
+        return self.recorder is not None or self.player is not None
+
+    @property
+    def replaying(self):
+        return self.player is not None
+
+    def state(self, state):
+        """Warm state to start from: saved in the recording, restored from it on replay"""
+        if self.player is not None:
+            state = self.player.state or {}
+            if self.player.recorded_at is not None:
+                _shift(state, self.started_at - self.player.recorded_at)
+            return state
+        if self.recorder is not None:
+            self.recorder.write(('state', time.time(), copy.deepcopy(state)))
+        return state
+
+    def api(self, factory, channel):
+        """Exchange client built by `factory`, every call is recorded or replayed"""
+        if self.player is not None:
+            return ReplayProxy(self.player, channel)
+        if self.recorder is not None:
+            return RecordingProxy(factory(), self.recorder, channel)
+        return factory()
+
+    def database(self, db, channel):
+        """MongoDB database `db` (None on replay), reads are recorded or replayed"""
+        if self.player is not None:
+            return ReplayProxy(self.player, channel, MONGO_READS)
+        if self.recorder is not None:
+            return RecordingProxy(db, self.recorder, channel, MONGO_READS)
+        return db
+
+    def guard(self, fn):
+        """`fn` returning quietly when it reaches the end of the replayed recording"""
+        def guarded(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except ReplayFinished as e:
+                print("End of recording: %s" % e)
+        return guarded
+
+    def sleep(self, seconds):
+        if self.player is None or self.player.pace:
+            time.sleep(seconds)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            print("Recorded %d calls to %s" % (self.recorder.count, self.recorder.path))
+        if self.player is not None:
+            print("Replayed %d/%d calls in %.3fs" % (
+                self.player.consumed, self.player.count, time.time() - self.started_at))
@@ -0,0 +1,179 @@
+"""
+Deadlines, hedged reads and circuit breaking for exchange requests
+
+Every request goes through `ResilientCaller.call` under an endpoint name:
+
+- the call is abandoned after the endpoint deadline (DEADLINES),
+- a read still running after the endpoint p95 latency is sent a second time,
+  the first answer wins (only if the `hedge_gate` given by the caller allows it,
+  e.g. when a rate budget token is available right away),
+- an endpoint failing `failures` times in a row is not called anymore for
+  `reset_after` seconds (circuit open), then one call is let through to test it,
+- a failed read returns the last value fetched under the same key when it is
+  younger than the staleness bound, instead of raising.
+
+Python threads cannot be cancelled, an abandoned request keeps its worker until
+the HTTP client timeout, so the pool is sized for a few stuck requests.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Seconds before a request is abandoned, None waits for the HTTP client timeout.
+# Orders are never abandoned nor duplicated: a timed out order may still be placed.
+DEADLINES = {
+    'ticker': 2,
+    'agg_trades': 2,
+    'get_order': 3,
+    'open_orders': 3,
+    'my_trades': 5,
+    'order': None,
+    'cancel_order': None,
+}
+DEFAULT_DEADLINE = 5
+
+# Minimum latency samples before hedging, and hedge delay floor in seconds
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    def __init__(self, failures=5, reset_after=30):
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Half open: let one call through to test the endpoint
+            if time.time() - self.opened_at >= self.reset_after:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.time()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class LatencyTracker(object):
+    def __init__(self, size=200):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        """95th percentile of the recent latencies, None until HEDGE_MIN_SAMPLES are known"""
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        samples = sorted(self.samples)
+        return samples[int(len(samples) * 0.95) - 1]
+
+
+class ResilientCaller(object):
+    def __init__(self, workers=8, failures=5, reset_after=30, max_staleness=30):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.failures = failures
+        self.reset_after = reset_after
+        self.max_staleness = max_staleness
+        # Recorded runs are not hedged, a duplicate answer would be replayed to the next call
+        self.hedging = True
+        self.breakers = {}
+        self.latencies = {}
+        self.last_values = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failures, self.reset_after)
+                self.latencies[endpoint] = LatencyTracker()
+            return self.breakers[endpoint], self.latencies[endpoint]
+
+    def _timed(self, fn, args):
+        started_at = time.time()
+        return fn(*args), time.time() - started_at
+
+    def _run(self, endpoint, fn, args, hedge, hedge_gate=None):
+        breaker, latency = self._endpoint(endpoint)
+        deadline = DEADLINES.get(endpoint, DEFAULT_DEADLINE)
+        if deadline is None:
+            value, elapsed = self._timed(fn, args)
+            latency.add(elapsed)
+            return value
+
+        started_at = time.time()
+        futures = [self.executor.submit(self._timed, fn, args)]
+        hedge_delay = latency.p95() if hedge and self.hedging else None
+        if hedge_delay is not None and hedge_delay < deadline:
+            done, _pending = wait(futures, timeout=max(hedge_delay, HEDGE_MIN_DELAY))
+            if not done and (hedge_gate is None or hedge_gate()):
+                futures.append(self.executor.submit(self._timed, fn, args))
+
+        error = None
+        while len(futures) > 0:
+            done, _pending = wait(futures, timeout=max(deadline - (time.time() - started_at), 0),
+                                  return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("%s deadline of %ss exceeded" % (endpoint, deadline))
+            for future in done:
+                futures.remove(future)
+                try:
+                    value, elapsed = future.result()
+                    latency.add(elapsed)
+                    return value
+                except Exception as e:
+                    # The hedged request may still succeed
+                    error = e
+        raise error
+
+    def call(self, endpoint, fn, *args, key=None, hedge=True, hedge_gate=None):
+        """Call `fn(*args)` as `endpoint`, reads given a `key` fall back to its last value on failure
+
+        `hedge_gate()` is called before sending a hedged duplicate, which is only sent if it returns True.
+        """
+        breaker, _latency = self._endpoint(endpoint)
+        try:
+            if not breaker.allow():
+                raise CircuitOpen("%s circuit open" % endpoint)
+            try:
+                value = self._run(endpoint, fn, args, hedge and key is not None, hedge_gate)
+            except Exception:
+                breaker.failure()
+                raise
+            breaker.success()
+        except Exception as e:
+            if key is not None and key in self.last_values:
+                value, at = self.last_values[key]
+                if time.time() - at <= self.max_staleness:
+                    print("%s failed (%s), using value of %.1fs ago" % (endpoint, e, time.time() - at))
+                    return value
+            raise
+
+        if key is not None:
+            self.last_values[key] = (value, time.time())
+        return value
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,58 @@
+"""
+Min-heap of the next opening times of markets having an `opening_schedule`
+
+Cron entries are parsed once when market settings are (re)loaded, each market
+is then held in the heap by its next fire time (UTC timestamp) so the caller
+only has to sleep until the top entry is due.
+"""
+import heapq
+import time
+import datetime as dt
+from crontab import CronTab
+
+
+class ScheduleHeap(object):
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.checked_until = time.time()
+
+    def rebuild(self, markets):
+        """Compile the opening schedules of `markets` (dict of market_settings keyed by market)"""
+        self.entries = {}
+        self.heap = []
+        for market, settings in markets.items():
+            if 'opening_schedule' not in settings:
+                continue
+            try:
+                entry = CronTab(settings['opening_schedule'])
+            except Exception as e:
+                print("%s - Invalid opening_schedule for market %s: %s" % (dt.datetime.now(), market, e))
+                continue
+
+            self.entries[market] = (entry, settings)
+            self._push(market, self.checked_until)
+
+    def _push(self, market, after):
+        entry, _settings = self.entries[market]
+        next_at = entry.next(now=after, delta=False, default_utc=True)
+        if next_at is not None:
+            heapq.heappush(self.heap, (next_at, market))
+
+    def next_due(self):
+        """Timestamp of the next opening, None if nothing is scheduled"""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now=None):
+        """Return the market settings due at `now` and schedule their next opening"""
+        now = now or time.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, market = heapq.heappop(self.heap)
+            due.append(self.entries[market][1])
+            self._push(market, max(fire_at, now))
+        self.checked_until = now
+        return due
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,180 @@
+"""
+In-memory cache of a settings collection (scalping_settings, market_settings ...)
+
+Documents are kept in a dict keyed by market and reloaded only when the
+collection changes: a background thread follows the collection's change stream
+and reloads on every event, at most once per `min_interval` seconds for busy
+collections. Change streams need a replica set, on a standalone mongod the
+thread falls back to reloading every `ttl` seconds.
+
+Collections written all the time (positions) use IncrementalCache instead,
+which applies the documents carried by the change events without reloading.
+"""
+import threading
+import time
+import datetime as dt
+from pymongo import DESCENDING
+from pymongo.errors import PyMongoError
+
+
+class SettingsCache(object):
+    # Change events carry no document, any change reloads the collection
+    full_document = None
+
+    def __init__(self, collection, query, key='market', ttl=60, min_interval=0):
+        self.collection = collection
+        self.query = query
+        self.key = key
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.version = 0
+        self.loaded_at = 0
+        self._documents = {}
+        self._dirty = False
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Load the documents and start following the collection changes"""
+        self.reload()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop following the collection changes"""
+        self._stopped.set()
+
+    def on_change(self, callback):
+        """Call `callback(documents)` after every reload"""
+        self._listeners.append(callback)
+
+    def load(self):
+        documents = {}
+        for document in self.collection.find(self.query):
+            documents[document[self.key]] = document
+        return documents
+
+    def reload(self):
+        self.publish(self.load())
+
+    def publish(self, documents):
+        """Replace the cached documents, readers keep the dict they got"""
+        with self._lock:
+            self._documents = documents
+            self.version += 1
+            self.loaded_at = time.monotonic()
+
+        for callback in self._listeners:
+            try:
+                callback(documents)
+            except Exception as e:
+                print("%s - Error in settings listener: %s" % (dt.datetime.now(), e))
+
+    def get(self, key, default=None):
+        return self._documents.get(key, default)
+
+    def documents(self):
+        return self._documents
+
+    def changed(self, event):
+        """Record a change event of the collection, applied by the next refresh()"""
+        self._dirty = True
+
+    def refresh(self):
+        self._dirty = False
+        self.reload()
+
+    def _watch(self):
+        use_change_stream = True
+        stream_opened = False
+        while not self._stopped.is_set():
+            try:
+                if use_change_stream:
+                    with self.collection.watch(max_await_time_ms=1000, full_document=self.full_document) as stream:
+                        stream_opened = True
+                        # Catch up with changes made before the stream got opened
+                        self.reload()
+                        while not self._stopped.is_set():
+                            event = stream.try_next()
+                            if event is not None:
+                                self.changed(event)
+                            if self._dirty and time.monotonic() - self.loaded_at >= self.min_interval:
+                                self.refresh()
+                elif not self._stopped.wait(self.ttl):
+                    self.reload()
+            except PyMongoError as e:
+                if stream_opened:
+                    # Stream interrupted (failover, network ...), open it again
+                    print("%s - Change stream on %s interrupted: %s" % (
+                        dt.datetime.now(), self.collection.name, e))
+                    self._stopped.wait(1)
+                elif use_change_stream:
+                    print("%s - Change stream unavailable on %s, reloading every %ss: %s" % (
+                        dt.datetime.now(), self.collection.name, self.ttl, e))
+                    use_change_stream = False
+                else:
+                    print("%s - Error while reloading %s: %s" % (dt.datetime.now(), self.collection.name, e))
+
+
+class IncrementalCache(SettingsCache):
+    """Cache of the documents matching `query`, keyed by _id, kept up to date from the change events
+
+    Update events carry the whole document (`updateLookup`) and `matches(document)`
+    tells if it still belongs to the cache, so the collection is only read when
+    the stream opens. Events are applied at most once per `min_interval` seconds.
+    """
+    full_document = 'updateLookup'
+
+    def __init__(self, collection, query, matches, ttl=60, min_interval=0):
+        super(IncrementalCache, self).__init__(collection, query, key='_id', ttl=ttl, min_interval=min_interval)
+        self.matches = matches
+        # _id: document, None once removed, the whole dict is None to reload
+        self._changes = {}
+
+    def reload(self):
+        self._changes = {}
+        super(IncrementalCache, self).reload()
+
+    def changed(self, event):
+        operation = event.get('operationType')
+        if operation in ('insert', 'replace', 'update'):
+            # No document when it got deleted before the lookup
+            document = event.get('fullDocument')
+            if self._changes is not None:
+                self._changes[event['documentKey']['_id']] = \
+                    document if document is not None and self.matches(document) else None
+        elif operation == 'delete':
+            if self._changes is not None:
+                self._changes[event['documentKey']['_id']] = None
+        else:
+            # drop, rename, invalidate ...
+            self._changes = None
+        self._dirty = True
+
+    def refresh(self):
+        self._dirty = False
+        changes, self._changes = self._changes, {}
+        if changes is None:
+            return self.reload()
+
+        documents = dict(self._documents)
+        for _id, document in changes.items():
+            if document is None:
+                documents.pop(_id, None)
+            else:
+                documents[_id] = document
+        self.publish(documents)
+
+
+class LatestDocumentCache(SettingsCache):
+    """Cache of the last document inserted in a collection (reports ...), kept under the `latest` key"""
+    def __init__(self, collection, query=None, sort_key='created_at', ttl=60, min_interval=0):
+        super(LatestDocumentCache, self).__init__(collection, query or {}, key=sort_key, ttl=ttl,
+                                                  min_interval=min_interval)
+
+    def load(self):
+        document = self.collection.find_one(self.query, sort=[(self.key, DESCENDING)])
+        return {'latest': document} if document is not None else {}
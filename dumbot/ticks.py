@@ -0,0 +1,74 @@
+"""
+Append-only tick recorder
+
+Every price seen by a bot is appended as a fixed-width (timestamp, price, volume)
+record to <directory>/<market>/<YYYYMMDD>.ticks, one file per market and UTC day.
+Files are read back through mmap as NumPy structured arrays, without parsing nor
+loading them in memory. The volume is the one reported with the price by the
+feed (24h rolling volume for REST tickers).
+
+    ticks = TickRecorder('ticks').view('BTCUSDT', dt.date(2020, 1, 23))
+    ticks['price'].max()
+"""
+import os
+import struct
+import threading
+import time
+import datetime as dt
+import numpy as np
+
+# Timestamp in milliseconds since epoch, price, volume
+TICK_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8'), ('volume', '<f8')])
+TICK_STRUCT = struct.Struct('<qdd')
+
+
+class TickRecorder(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def path(self, market, day):
+        return os.path.join(self.directory, market, '%s.ticks' % day.strftime('%Y%m%d'))
+
+    def record(self, market, price, volume=0, ts=None):
+        ts = ts if ts is not None else time.time()
+        day = dt.datetime.utcfromtimestamp(ts).date()
+
+        with self._lock:
+            # Roll to a new file on day change
+            current = self.files.get(market)
+            if current is None or current[0] != day:
+                if current is not None:
+                    current[1].close()
+                path = self.path(market, day)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                current = self.files[market] = (day, open(path, 'ab'))
+
+            current[1].write(TICK_STRUCT.pack(int(ts * 1000), price, volume or 0))
+
+    def flush(self):
+        with self._lock:
+            for _day, f in self.files.values():
+                f.flush()
+
+    def close(self):
+        with self._lock:
+            for _day, f in self.files.values():
+                f.close()
+            self.files = {}
+
+    def view(self, market, day):
+        """Zero-copy structured array of the ticks recorded for `market` on `day`"""
+        path = self.path(market, day)
+        count = os.path.getsize(path) // TICK_DTYPE.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.empty(0, dtype=TICK_DTYPE)
+
+        # Ignore a trailing partial record left by a crash
+        return np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(count,))
+
+    def views(self, market, start, end):
+        """Views of every day from `start` to `end` (dates, inclusive)"""
+        days = [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+        return [self.view(market, day) for day in days]
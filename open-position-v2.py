@@ -1,26 +1,50 @@
 """
 This script will open a new position no matter the price.
 
-It is based on the market_settings collection
+It is based on the market_settings collection, opening schedules are compiled
+once and refreshed only when market_settings change.
 """
 import yaml
 import argparse
+import threading
 import time
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
-from crontab import CronTab
 
-from binance.client import Client as Binance
-from binance.enums import *
+from dumbot.settings_cache import SettingsCache
+from dumbot.schedule import ScheduleHeap
+from dumbot.exchange import refresh_exchange_symbols, load_last_prices
+from dumbot.rate_budget import binance_budgets
+from dumbot.opening import check_filters, opening_document, record_positions
+from dumbot.checkpoint import Checkpoint, supervise
+from dumbot.accounts import get_account
+from dumbot.price_cache import PriceCache, cache_path
+from dumbot.exposure import ExposureCaps
 
 parser = argparse.ArgumentParser(description='Exchange buyer bot based on market_settings collection.')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
+parser.add_argument('--account', type=str, required=False, default=None,
+                    help='Account to open positions with (see accounts in config), defaults to the default account')
+parser.add_argument('--workers', type=int, required=False, default=20,
+                    help='Maximum number of orders placed in parallel')
+parser.add_argument('--price-max-age', type=float, required=False, default=10,
+                    help='Age in seconds above which host price cache prices are ignored, 0 disables the cache')
+parser.add_argument('--checkpoint', type=str, required=False, default='open-position-v2.checkpoint',
+                    help='Warm state snapshot file')
 
 args = parser.parse_args()
 exchange = 'binance'
 
-try:
+# Openings missed while stopped are caught up if not older than CATCH_UP_SECONDS
+CATCH_UP_SECONDS = 60
+
+checkpoint = Checkpoint(args.checkpoint)
+state = checkpoint.load()
+
+
+def run():
     # Load configuration
     config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
 
@@ -29,108 +53,175 @@ try:
     mongo.server_info()
     db = mongo[config.get('db_name', 'dumbot')]
 
+    # Host price cache, fed by price-cache.py
+    price_cache = PriceCache.open(cache_path(config, exchange)) if args.price_max_age > 0 else None
+
     # Exchange API keys
-    API_KEY = config.get('%s_api_key' % exchange, None)
-    API_SECRET = config.get('%s_api_secret' % exchange, None)
-
-    locked_markets = {}
-    while True:
-        # Clean expired locked markets
-        for locked_market, data in list(locked_markets.items()):
-            if data['locked_until'] < dt.datetime.utcnow():
-                del(locked_markets[locked_market])
-
-        open_queue = []
-        # Fill the open_queue
-        for market in db.market_settings.find({"trading": True}):
+    account = get_account(config, exchange, args.account)
+    API_KEY = account['api_key']
+    API_SECRET = account['api_secret']
+
+    # Wake up the scheduler whenever market_settings change
+    settings_changed = threading.Event()
+    settings = SettingsCache(db.market_settings, {"trading": True})
+    settings.on_change(lambda documents: settings_changed.set())
+    settings.start()
+
+    # Exposure published by the trailing stoploss loops, followed only when caps are configured
+    caps = ExposureCaps(config.get('exposure_caps', None))
+    exposure = SettingsCache(db.exposure, {'exchange': exchange}, key='_id', min_interval=5).start() \
+        if caps.enabled else None
+
+    # Initialize binance api, imported once the command line is parsed
+    from binance.client import Client as Binance
+    from binance.enums import SIDE_BUY, ORDER_TYPE_LIMIT, TIME_IN_FORCE_GTC
+    api = Binance(API_KEY, API_SECRET)
+    rate_budget, order_budget = binance_budgets()
+
+    # Market limits and parameters (binance specific), restored from the checkpoint if fresh enough
+    exchange_state = state.setdefault('exchanges', {}).setdefault(exchange, {})
+    exchange_symbols, quantizer = refresh_exchange_symbols(exchange_state, api, rate_budget)
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    def open_position(market, tickers):
+        """Place the opening order of `market` and return the position document"""
+        if 'opening_usdt_amount' not in market:
+            return None
+
+        ticker = tickers[market['market']]
+        market_info = exchange_symbols[market['market']]
+
+        # 2. Buy with opening_usdt_amount value, quantity floored to the LOT_SIZE step
+        _quantity = quantizer.quantize_qty(market['market'], market['opening_usdt_amount'] / ticker)
+        _rate = quantizer.quantize_price(market['market'], ticker)
+        errors = check_filters(market_info, _quantity, _rate)
+        if len(errors) > 0:
+            raise Exception("Order rejected by market filters: %s" % ', '.join(errors))
+
+        order_budget.acquire(1)
+        rate_budget.acquire('order')
+        r = api.create_order(
+            symbol=market['market'],
+            side=SIDE_BUY,
+            type=ORDER_TYPE_LIMIT,
+            timeInForce=TIME_IN_FORCE_GTC,
+            quantity=quantizer.format_qty(market['market'], _quantity),
+            price=quantizer.format_price(market['market'], _rate))
+        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
+            raise Exception("Could not open position on broker: %s" % r)
+        open_order_id = r.get('orderId')
+
+        print("%s New position %s %s @ %s: %s" % (
+            dt.datetime.now(),
+            _quantity,
+            market['market'],
+            _rate,
+            open_order_id
+        ))
+
+        return opening_document(market['market'], open_order_id, exchange, _rate, _quantity,
+                                hodl=market.get('hodl', False), account=account['name'])
+
+    # Resume the schedule where it stopped
+    schedule = ScheduleHeap()
+    schedule.checked_until = max(state.get('checked_until', 0), time.time() - CATCH_UP_SECONDS)
+    schedule_version = None
+    locked_markets = state.setdefault('locked_markets', {})
+    try:
+        while True:
+            # Recompile schedules on settings change
+            if schedule_version != settings.version:
+                schedule_version = settings.version
+                schedule.rebuild(settings.documents())
+                print("%s - %s opening schedules loaded" % (dt.datetime.now(), len(schedule)))
+
+            # Sleep until the next opening, or until settings change
+            next_due = schedule.next_due()
+            settings_changed.wait(None if next_due is None else max(next_due - time.time(), 0))
+            if settings_changed.is_set():
+                settings_changed.clear()
+                continue
+
+            # Refresh market limits
             try:
-                if 'opening_schedule' not in market:
-                    continue
-                entry = CronTab(market['opening_schedule'])
+                exchange_symbols, quantizer = refresh_exchange_symbols(exchange_state, api, rate_budget, quantizer)
+            except Exception as e:
+                print("%s - Cannot refresh exchange info: %s" % (dt.datetime.now(), e))
+
+            # Clean expired locked markets
+            for locked_market, data in list(locked_markets.items()):
+                if data['locked_until'] < dt.datetime.utcnow():
+                    del(locked_markets[locked_market])
 
-                if entry.next(default_utc=True) < 60 and market['market'] not in locked_markets:
+            open_queue = []
+            # Fill the open_queue
+            for market in schedule.pop_due():
+                if market['market'] not in locked_markets:
                     print("%s - %s hit !" % (dt.datetime.now(), market['market']))
                     open_queue.append(market)
-            except Exception as e:
-                print("%s - Error in loop 1 with market %s: %s" % (dt.datetime.now(), market['market'], e))
-
-        if len(open_queue) > 0:
-            # Re-Initialize binance api
-            api = Binance(API_KEY, API_SECRET)
-
-            # Is binance alive ?
-            if api.get_system_status().get("status", -1) != 0:
-                raise Exception("Exchange unavailable for trading")
-
-            # Execute open queue
-            for market in open_queue:
-                try:
-                    # Open position logic:
-                    # 1. Get market last price
-                    r = api.get_ticker(symbol=market['market'])
-                    ticker = float(r.get('lastPrice', None))
-
-                    # 1'. Get market limits and parameters (binance specific)
-                    market_info = api.get_symbol_info(market['market'])
-                    market_filters = {}
-                    for _f in market_info.get('filters', {}):
-                        market_filters[_f['filterType']] = _f
-
-                    if 'opening_usdt_amount' in market:
-                        # 2. Buy with args.total value
-                        # Calculate the _quantity in respect to LOT_SIZE filter (binance specific) then make it compliant to stepSize
-                        _quantity = market['opening_usdt_amount'] / ticker
-                        _LOT_SIZE_maxQty = float(market_filters['LOT_SIZE']['maxQty'])
-                        _LOT_SIZE_minQty = float(market_filters['LOT_SIZE']['minQty'])
-                        _LOT_SIZE_stepSize = float(market_filters['LOT_SIZE']['stepSize'])
-                        _quantity -= ((_quantity - _LOT_SIZE_minQty) % _LOT_SIZE_stepSize)
-                        _quantity = float(format(_quantity, '.%sf' % market_info.get('baseAssetPrecision', 2)))
-                        _rate = ticker
-                        r = api.create_order(
-                            symbol=market['market'],
-                            side=SIDE_BUY,
-                            type=ORDER_TYPE_LIMIT,
-                            timeInForce=TIME_IN_FORCE_GTC,
-                            quantity=_quantity,
-                            price=_rate)
-                        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
-                            raise Exception("Could not open position on broker: %s" % r)
-                        open_order_id = r.get('orderId')
-
-                        print("%s New position %s %s @ %s: %s" % (
-                            dt.datetime.now(),
-                            _quantity,
-                            market['market'],
-                            _rate,
-                            open_order_id
-                        ))
-
-                        _doc = {
-                            "open_at": dt.datetime.utcnow(),
-                            "status": "opening",
-                            "market": market['market'],
-                            "open_order_id": open_order_id,
-                            "broker": exchange,
-                            "open_rate": _rate,
-                            "volume": _quantity,
-                            "current_price": _rate,
-                            "price_at": dt.datetime.utcnow(),
-                            'last_update_at': dt.datetime.utcnow(),
-                        }
-
-                        # Shall we hodl this position ?
-                        if market.get('hodl', False):
-                            _doc['hodl'] = True
-
-                        db.positions.insert_one(_doc)
-
-                        # Lock this market for 5 minutes to avoid multiple openings in very short time
-                        locked_markets[market['market']] = {'locked_until': dt.datetime.utcnow() + dt.timedelta(minutes=5)}
-                except Exception as e:
-                    print("%s - Error in loop 2 with market %s: %s" % (dt.datetime.now(), market['market'], e))
-
-        time.sleep(10)
+            state['checked_until'] = schedule.checked_until
+
+            # Keep the openings within the exposure caps, counting the ones of this queue
+            if exposure is not None and len(open_queue) > 0:
+                planned = []
+                allowed = []
+                for market in open_queue:
+                    _asset = exchange_symbols.get(market['market'], {}).get('baseAsset')
+                    _amount = market.get('opening_usdt_amount', 0)
+                    reason = caps.exceeded(exposure.documents().values(), market['market'], _asset, _amount, planned)
+                    if reason is not None:
+                        print("%s - %s not opened: %s" % (dt.datetime.now(), market['market'], reason))
+                        continue
+                    planned.append((market['market'], _asset, _amount))
+                    allowed.append(market)
+                open_queue = allowed
+
+            if len(open_queue) > 0:
+                # Is binance alive ?
+                rate_budget.acquire(1)
+                if api.get_system_status().get("status", -1) != 0:
+                    raise Exception("Exchange unavailable for trading")
+
+                # 1. Get markets last price from the host price cache,
+                # or with one request for the whole queue
+                tickers = price_cache.prices(args.price_max_age) if price_cache is not None else {}
+                if any(m['market'] not in tickers for m in open_queue):
+                    rate_budget.acquire('all_tickers')
+                    tickers = load_last_prices(api)
+
+                # Lock these markets for 5 minutes to avoid multiple openings in very short time, and save
+                # the schedule before ordering so that a restart never catches up openings already placed
+                for market in open_queue:
+                    locked_markets[market['market']] = {'locked_until': dt.datetime.utcnow() + dt.timedelta(minutes=5)}
+                checkpoint.save(state)
+
+                # Execute open queue concurrently
+                docs = []
+                for market, future in [(m, executor.submit(open_position, m, tickers)) for m in open_queue]:
+                    try:
+                        _doc = future.result()
+                        if _doc is not None:
+                            docs.append(_doc)
+                    except Exception as e:
+                        print("%s - Error in loop 2 with market %s: %s" % (dt.datetime.now(), market['market'], e))
+
+                # Orders are placed, never let a database error skip their positions silently
+                if len(docs) > 0:
+                    for _doc in record_positions(db.positions, docs):
+                        print("%s - Error in loop 2 with market %s: order %s placed but not recorded, fix it manually" % (
+                            dt.datetime.now(), _doc['market'], _doc['open_order_id']))
+
+            checkpoint.maybe_save(state)
+    finally:
+        settings.stop()
+        if exposure is not None:
+            exposure.stop()
+        executor.shutdown(wait=False)
 
+
+try:
+    supervise(run, 'Scheduled opener')
 except Exception as e:
     print("%s - Error: %s" % (dt.datetime.now(), e))
 finally:
@@ -1,29 +1,123 @@
 """
 This script will open a new position no matter the price.
+
+With --batch, a list of (market, total) entries is read from a CSV or YAML file
+(or stdin), validated against the market filters then opened concurrently.
 """
-import yaml
+import sys
+import csv
 import argparse
-import datetime as dt
-from pymongo import MongoClient
-
-from bittrex.bittrex import Bittrex, API_V2_0, API_V1_1
-
-from binance.client import Client as Binance
-from binance.enums import *
 
 parser = argparse.ArgumentParser(description='Exchange buyer bot.')
 parser.add_argument('--exchange', choices=['bittrex', 'binance'], required=True,
                     help='Exchange to use')
 parser.add_argument('--market-base', type=str, default='USDT',
                     help='Market base (ex: USD for market USD-BTC)')
-parser.add_argument('--market-currency', type=str, required=True,
+parser.add_argument('--market-currency', type=str, required=False,
                     help='Market base (ex: BTC for market USD-BTC)')
-parser.add_argument('--total', type=float, required=True,
+parser.add_argument('--total', type=float, required=False,
                     help='Total amount to pay in marker-base currency')
+parser.add_argument('--batch', type=str, required=False,
+                    help='CSV (market,total) or YAML ([{market, total}]) file of positions to open, "-" for stdin '
+                         '(binance only)')
+parser.add_argument('--account', type=str, required=False, default=None,
+                    help='Account to open positions with (see accounts in config), defaults to the default account')
+parser.add_argument('--workers', type=int, required=False, default=10,
+                    help='Maximum number of orders placed in parallel in batch mode')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
 
 args = parser.parse_args()
+if args.batch is None and (args.market_currency is None or args.total is None):
+    parser.error("--market-currency and --total are required unless --batch is used")
+
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+
+from dumbot.exchange import load_exchange_symbols, load_last_prices
+from dumbot.rate_budget import binance_budgets
+from dumbot.opening import check_filters, opening_document, record_positions
+from dumbot.quantizer import QuantizerTable
+from dumbot.accounts import get_account
+
+
+def read_batch(path):
+    """Return the [(market, total), ...] entries of a CSV or YAML batch file"""
+    content = sys.stdin.read() if path == '-' else open(path, 'r').read()
+
+    if path.endswith(('.yml', '.yaml')) or content.lstrip().startswith(('-', '[')):
+        rows = [(_e['market'], _e['total']) for _e in yaml.load(content, Loader=yaml.SafeLoader) or []]
+    else:
+        rows = [_r for _r in csv.reader(content.splitlines()) if len(_r) > 0 and not _r[0].startswith('#')]
+        # Skip header
+        if len(rows) > 0 and rows[0][0].strip().lower() == 'market':
+            rows = rows[1:]
+
+    return [(str(market).strip().upper(), float(total)) for market, total in rows]
+
+
+def open_batch(api, db, entries, account_name):
+    """Validate all entries against the market filters, then open them concurrently"""
+    from binance.enums import SIDE_BUY, ORDER_TYPE_LIMIT, TIME_IN_FORCE_GTC
+
+    rate_budget, order_budget = binance_budgets()
+
+    # Market limits and last prices, fetched once for the whole batch
+    exchange_symbols = load_exchange_symbols(api)
+    quantizer = QuantizerTable(exchange_symbols)
+    tickers = load_last_prices(api)
+
+    # Validate everything before submitting anything
+    orders = []
+    errors = []
+    for market, total in entries:
+        if market not in exchange_symbols or market not in tickers:
+            errors.append("%s: unknown market" % market)
+            continue
+
+        _rate = quantizer.quantize_price(market, tickers[market])
+        _quantity = quantizer.quantize_qty(market, total / _rate)
+        for error in check_filters(exchange_symbols[market], _quantity, _rate):
+            errors.append("%s: %s" % (market, error))
+        orders.append((market, _quantity, _rate))
+
+    if len(errors) > 0:
+        for error in errors:
+            print(" > %s" % error)
+        raise Exception("%s invalid entries, nothing submitted" % len(errors))
+
+    def place(order):
+        market, _quantity, _rate = order
+        order_budget.acquire(1)
+        rate_budget.acquire('order')
+        r = api.create_order(
+            symbol=market,
+            side=SIDE_BUY,
+            type=ORDER_TYPE_LIMIT,
+            timeInForce=TIME_IN_FORCE_GTC,
+            quantity=quantizer.format_qty(market, _quantity),
+            price=quantizer.format_price(market, _rate))
+        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
+            raise Exception("Could not open position on broker: %s" % r)
+
+        print("New position %s %s @ %s: %s" % (_quantity, market, _rate, r.get('orderId')))
+        return opening_document(market, r.get('orderId'), 'binance', _rate, _quantity, account=account_name)
+
+    docs = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for order, future in [(_o, executor.submit(place, _o)) for _o in orders]:
+            try:
+                docs.append(future.result())
+            except Exception as e:
+                print("Error with market %s: %s" % (order[0], e))
+
+    lost = record_positions(db.positions, docs) if len(docs) > 0 else []
+    for _doc in lost:
+        print("Error with market %s: order %s placed but not recorded, fix it manually" % (
+            _doc['market'], _doc['open_order_id']))
+    print("%s/%s positions opened" % (len(docs) - len(lost), len(orders)))
 
 try:
     # Load configuration
@@ -35,95 +129,97 @@ try:
     db = mongo[config.get('db_name', 'dumbot')]
 
     # Exchange API keys
-    API_KEY = config.get('%s_api_key' % args.exchange, None)
-    API_SECRET = config.get('%s_api_secret' % args.exchange, None)
-
-    if args.exchange == 'bittrex':
-        market = "%s-%s" % (args.market_base, args.market_currency)
-
-        # Initialize bittrex api
-        api = Bittrex(API_KEY, API_SECRET, api_version=API_V1_1)
-
-        # Open position logic:
-        # 1. Get market last ask price
-        r = api.get_ticker(market)
-        if not r.get('success', False):
-            raise Exception("Got an error while querying broker: %s" % r.get('message', 'nd'))
-        ticker = r.get('result')
-
-        # 2. Buy with args.total value
-        _quantity = args.total / ticker.get('Ask', 0)
-        _rate = ticker.get('Ask', 0)
-        r = api.buy_limit(market, quantity=_quantity, rate=_rate)
-        if not r.get('success', False):
-            raise Exception("Could not open position on broker: %s" % r.get('message', 'nd'))
-
-        open_order_id = r.get('result', {}).get('uuid', None)
-    elif args.exchange == 'binance':
-        market = "%s%s" % (args.market_currency, args.market_base)
-
-        # Initialize binance api
+    account = get_account(config, args.exchange, args.account)
+    API_KEY = account['api_key']
+    API_SECRET = account['api_secret']
+
+    if args.batch is not None:
+        if args.exchange != 'binance':
+            raise NotImplementedError("Batch mode is only implemented for Binance exchanges")
+
+        entries = read_batch(args.batch)
+
+        # Initialize binance api, exchange libraries are only imported when used
+        from binance.client import Client as Binance
         api = Binance(API_KEY, API_SECRET)
 
         # Is binance alive ?
         if api.get_system_status().get("status", -1) != 0:
             raise Exception("Exchange unavailable for trading")
 
-        # Open position logic:
-        # 1. Get market last price
-        r = api.get_ticker(symbol=market)
-        ticker = float(r.get('lastPrice', None))
-
-        # 1'. Get market limits and parameters (binance specific)
-        market_info = api.get_symbol_info(market)
-        market_filters = {}
-        for _f in market_info.get('filters', {}):
-            market_filters[_f['filterType']] = _f
-
-        # 2. Buy with args.total value
-        # Calculate the _quantity in respect to LOT_SIZE filter (binance specific) then make it compliant to stepSize
-        _quantity = args.total / ticker
-        _LOT_SIZE_maxQty = float(market_filters['LOT_SIZE']['maxQty'])
-        _LOT_SIZE_minQty = float(market_filters['LOT_SIZE']['minQty'])
-        _LOT_SIZE_stepSize = float(market_filters['LOT_SIZE']['stepSize'])
-        _quantity -= ((_quantity - _LOT_SIZE_minQty) % _LOT_SIZE_stepSize)
-        _quantity = float(format(_quantity, '.%sf' % market_info.get('baseAssetPrecision', 2)))
-        _rate = ticker
-        r = api.create_order(
-            symbol=market,
-            side=SIDE_BUY,
-            type=ORDER_TYPE_LIMIT,
-            timeInForce=TIME_IN_FORCE_GTC,
-            quantity=_quantity,
-            price=_rate)
-        if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
-            raise Exception("Could not open position on broker: %s" % r)
-
-        open_order_id = r.get('orderId')
+        open_batch(api, db, entries, account['name'])
     else:
-        raise NotImplementedError
-
-    print("New position %s%s @ %s%s: %s" % (
-        _quantity,
-        args.market_currency,
-        _rate,
-        args.market_base,
-        open_order_id
-    ))
-
-    _doc = {
-        "open_at": dt.datetime.utcnow(),
-        "status": "opening",
-        "market": market,
-        "open_order_id": open_order_id,
-        "broker": args.exchange,
-        "open_rate": _rate,
-        "volume": _quantity,
-        "current_price": _rate,
-        "price_at": dt.datetime.utcnow(),
-        'last_update_at': dt.datetime.utcnow(),
-    }
-    db.positions.insert_one(_doc)
+        if args.exchange == 'bittrex':
+            market = "%s-%s" % (args.market_base, args.market_currency)
+
+            # Initialize bittrex api, exchange libraries are only imported when used
+            from bittrex.bittrex import Bittrex, API_V1_1
+            api = Bittrex(API_KEY, API_SECRET, api_version=API_V1_1)
+
+            # Open position logic:
+            # 1. Get market last ask price
+            r = api.get_ticker(market)
+            if not r.get('success', False):
+                raise Exception("Got an error while querying broker: %s" % r.get('message', 'nd'))
+            ticker = r.get('result')
+
+            # 2. Buy with args.total value
+            _quantity = args.total / ticker.get('Ask', 0)
+            _rate = ticker.get('Ask', 0)
+            r = api.buy_limit(market, quantity=_quantity, rate=_rate)
+            if not r.get('success', False):
+                raise Exception("Could not open position on broker: %s" % r.get('message', 'nd'))
+
+            open_order_id = r.get('result', {}).get('uuid', None)
+        elif args.exchange == 'binance':
+            market = "%s%s" % (args.market_currency, args.market_base)
+
+            # Initialize binance api, exchange libraries are only imported when used
+            from binance.client import Client as Binance
+            from binance.enums import SIDE_BUY, ORDER_TYPE_LIMIT, TIME_IN_FORCE_GTC
+            api = Binance(API_KEY, API_SECRET)
+
+            # Is binance alive ?
+            if api.get_system_status().get("status", -1) != 0:
+                raise Exception("Exchange unavailable for trading")
+
+            # Open position logic:
+            # 1. Get market last price
+            r = api.get_ticker(symbol=market)
+            ticker = float(r.get('lastPrice', None))
+
+            # 1'. Get market limits and parameters (binance specific)
+            market_info = api.get_symbol_info(market)
+            market_info['filters'] = dict((_f['filterType'], _f) for _f in market_info.get('filters', {}))
+            quantizer = QuantizerTable({market: market_info})
+
+            # 2. Buy with args.total value, quantity floored to the LOT_SIZE step
+            _quantity = quantizer.quantize_qty(market, args.total / ticker)
+            _rate = quantizer.quantize_price(market, ticker)
+            r = api.create_order(
+                symbol=market,
+                side=SIDE_BUY,
+                type=ORDER_TYPE_LIMIT,
+                timeInForce=TIME_IN_FORCE_GTC,
+                quantity=quantizer.format_qty(market, _quantity),
+                price=quantizer.format_price(market, _rate))
+            if r.get('status', None) not in ['PARTIALLY_FILLED', 'NEW', 'FILLED'] or r.get('orderId', None) is None:
+                raise Exception("Could not open position on broker: %s" % r)
+
+            open_order_id = r.get('orderId')
+        else:
+            raise NotImplementedError
+
+        print("New position %s%s @ %s%s: %s" % (
+            _quantity,
+            args.market_currency,
+            _rate,
+            args.market_base,
+            open_order_id
+        ))
+
+        db.positions.insert_one(opening_document(market, open_order_id, args.exchange, _rate, _quantity,
+                                                 account=account['name']))
 except Exception as e:
     print("Error: %s" % e)
 finally:
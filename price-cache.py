@@ -0,0 +1,111 @@
+"""
+This script feeds the host-local price cache (see dumbot.price_cache).
+
+One instance per exchange and host: Binance prices are streamed from the all
+markets mini ticker websocket and the traded low and high of every second from
+the 1s kline streams of the trading markets, Bittrex prices are polled from
+market summaries. Bots of the host read the cache file instead of requesting tickers.
+"""
+import yaml
+import argparse
+import time
+import datetime as dt
+
+from dumbot.price_cache import PriceCacheWriter, cache_path
+from dumbot.checkpoint import supervise
+
+parser = argparse.ArgumentParser(description='Host-local price cache feed.')
+parser.add_argument('--exchange', choices=['bittrex', 'binance'], required=True,
+                    help='Exchange to use')
+parser.add_argument('--config', type=str, required=False, default="config.yml",
+                    help='Config file')
+parser.add_argument('--path', type=str, required=False, default=None,
+                    help='Cache file, defaults to price_cache.<exchange> in config or /dev/shm/dumbot-<exchange>.prices')
+parser.add_argument('--poll-interval', type=float, required=False, default=2,
+                    help='Seconds between two polls of exchanges without price stream')
+
+args = parser.parse_args()
+
+# Kline streams per websocket connection, Binance accepts up to 1024
+KLINE_STREAMS_PER_SOCKET = 200
+
+
+def feed_binance(writer):
+    from binance import ThreadedWebsocketManager
+    from binance.client import Client as Binance
+    from dumbot.exchange import load_exchange_symbols
+
+    def handle_prices(msg):
+        # All markets mini ticker: [{'s': 'BTCUSDT', 'c': '9500.01', 'v': '1234.5', ...}, ...]
+        if isinstance(msg, dict):
+            if msg.get('e') == 'error':
+                print("%s - Price stream error: %s" % (dt.datetime.now(), msg))
+            return
+        try:
+            # Closes sampled every second miss the wicks, the ring is fed by the klines
+            writer.update(dict((_t['s'], (float(_t['c']), float(_t.get('v', 0)))) for _t in msg), ring=False)
+        except Exception as e:
+            print("%s - Error in price handling: %s" % (dt.datetime.now(), e))
+
+    def handle_klines(msg):
+        # Combined stream: {'stream': 'btcusdt@kline_1s', 'data': {'s': 'BTCUSDT', 'k': {'c': ..., 'l': ..., 'h': ...}}}
+        if 'data' not in msg:
+            if msg.get('e') == 'error':
+                print("%s - Kline stream error: %s" % (dt.datetime.now(), msg))
+            return
+        try:
+            kline = msg['data']['k']
+            writer.update({msg['data']['s']: (float(kline['c']), None, float(kline['l']), float(kline['h']))})
+        except Exception as e:
+            print("%s - Error in kline handling: %s" % (dt.datetime.now(), e))
+
+    # Public endpoints and streams, no api key needed
+    symbols = sorted(_s for _s, _info in load_exchange_symbols(Binance()).items()
+                     if _info.get('status') == 'TRADING')
+
+    twm = ThreadedWebsocketManager()
+    try:
+        twm.start()
+        twm.start_miniticker_socket(callback=handle_prices)
+        for i in range(0, len(symbols), KLINE_STREAMS_PER_SOCKET):
+            twm.start_multiplex_socket(callback=handle_klines, streams=[
+                '%s@kline_1s' % _s.lower() for _s in symbols[i:i + KLINE_STREAMS_PER_SOCKET]])
+        twm.join()
+        raise Exception("Websocket manager stopped")
+    finally:
+        twm.stop()
+
+
+def feed_bittrex(writer):
+    from bittrex.bittrex import Bittrex, API_V1_1
+
+    api = Bittrex(None, None, api_version=API_V1_1)
+    while True:
+        r = api.get_market_summaries()
+        if not r.get('success', False):
+            raise Exception("Cannot get market summaries: %s" % r)
+        writer.update(dict((_s['MarketName'], (float(_s['Last']), float(_s.get('Volume') or 0)))
+                           for _s in r.get('result') or [] if _s.get('Last') is not None))
+        time.sleep(args.poll_interval)
+
+
+def run():
+    # Load configuration
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+    path = args.path or cache_path(config, args.exchange)
+    writer = PriceCacheWriter(path)
+    print("%s - Feeding %s prices to %s" % (dt.datetime.now(), args.exchange, path))
+
+    if args.exchange == 'binance':
+        feed_binance(writer)
+    else:
+        feed_bittrex(writer)
+
+
+try:
+    supervise(run, 'Price cache')
+except Exception as e:
+    print("%s - Error: %s" % (dt.datetime.now(), e))
+finally:
+    print("%s - Stopped" % dt.datetime.now())
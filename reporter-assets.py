@@ -1,15 +1,10 @@
 """
 This script keeps a reports_assets collection updated every hour
 """
-import yaml
 import copy
 import argparse
 import datetime as dt
 import time
-from pymongo import MongoClient
-
-from binance.client import Client as Binance
-from binance.enums import *
 
 parser = argparse.ArgumentParser(description='Updates reports_assets collection '
                                              'with data from Binance api')
@@ -18,6 +13,13 @@ parser.add_argument('--config', type=str, required=False, default="config.yml",
 
 args = parser.parse_args()
 exchange = 'binance'
+PRICE_MAX_AGE = 60
+
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from pymongo import MongoClient
+
+from dumbot.price_cache import PriceCache, cache_path
 
 try:
     if exchange != 'binance':
@@ -28,7 +30,6 @@ try:
 
     # Initialize mongo api
     mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
     db = mongo[config.get('db_name', 'dumbot')]
 
     # Exchange API keys
@@ -36,17 +37,20 @@ try:
     API_SECRET = config.get('%s_api_secret' % exchange, None)
     SLEEP_SECONDS = 10
 
-    # Initialize exchange api
+    # Initialize exchange api, imported on use
+    from binance.client import Client as Binance
     api = Binance(API_KEY, API_SECRET)
-    # Is binance alive ?
-    if api.get_system_status().get("status", -1) != 0:
-        raise Exception("Exchange unavailable for trading")
+
+    # Host price cache, fed by price-cache.py
+    price_cache = PriceCache.open(cache_path(config, exchange))
 
     # Get asset details based on market_settings
     for _o in db.market_settings.find({"$or": [{"reporting": True}, {"trading": True}]}):
-        # Get 24h ticker
-        r = api.get_ticker(symbol=_o['market'])
-        ticker = float(r.get('lastPrice', None))
+        # Get last price, from the host price cache if fresh
+        ticker = price_cache.price(_o['market'], PRICE_MAX_AGE) if price_cache is not None else None
+        if ticker is None:
+            r = api.get_ticker(symbol=_o['market'])
+            ticker = float(r.get('lastPrice', None))
 
         # Get asset
         asset_details = api.get_asset_balance(asset=_o['asset'])
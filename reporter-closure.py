@@ -1,15 +1,10 @@
 """
 This script pushes pair performance stats on closure to DB
 """
-import yaml
 import copy
 import argparse
 import datetime as dt
 import time
-from pymongo import MongoClient
-
-from binance.client import Client as Binance
-from binance.enums import *
 
 parser = argparse.ArgumentParser(description='Calculates trading stats per pair on closure and persist '
                                              'them to reports_closure'
@@ -21,6 +16,12 @@ parser.add_argument('--config', type=str, required=False, default="config.yml",
 
 args = parser.parse_args()
 
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from pymongo import MongoClient
+
+from dumbot.archive import archived_closures
+
 try:
     if args.exchange != 'binance':
         raise NotImplementedError("Reporter is only implemeted for Binance exchanges")
@@ -30,19 +31,8 @@ try:
 
     # Initialize mongo api
     mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
     db = mongo[config.get('db_name', 'dumbot')]
 
-    # Exchange API keys
-    API_KEY = config.get('%s_api_key' % args.exchange, None)
-    API_SECRET = config.get('%s_api_secret' % args.exchange, None)
-
-    # Initialize exchange api
-    api = Binance(API_KEY, API_SECRET)
-    # Is binance alive ?
-    if api.get_system_status().get("status", -1) != 0:
-        raise Exception("Exchange unavailable for trading")
-
     # Get market_settings
     markets = {}
     _skeleton = {
@@ -107,6 +97,9 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['cumulated_gain'] = _res[0].get('sum')
+            _archived_closed_positions, _archived_gain = archived_closures(db, position['market'])
+            if _archived_closed_positions > 0:
+                markets[_key]['cumulated_gain'] = (markets[_key]['cumulated_gain'] or 0) + _archived_gain
 
             # Get 24h gain for this market
             _left = right - dt.timedelta(hours=24)
@@ -137,6 +130,9 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['1w_gain'] = _res[0].get('sum')
+            _archived_count, _archived_gain = archived_closures(db, position['market'], _left)
+            if _archived_count > 0:
+                markets[_key]['1w_gain'] = (markets[_key]['1w_gain'] or 0) + _archived_gain
 
             # Get 1m gain for this market
             _left = right - dt.timedelta(days=31)
@@ -152,6 +148,9 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['1m_gain'] = _res[0].get('sum')
+            _archived_count, _archived_gain = archived_closures(db, position['market'], _left)
+            if _archived_count > 0:
+                markets[_key]['1m_gain'] = (markets[_key]['1m_gain'] or 0) + _archived_gain
 
             # Get 3m gain for this market
             _left = right - dt.timedelta(days=93)
@@ -167,6 +166,9 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['3m_gain'] = _res[0].get('sum')
+            _archived_count, _archived_gain = archived_closures(db, position['market'], _left)
+            if _archived_count > 0:
+                markets[_key]['3m_gain'] = (markets[_key]['3m_gain'] or 0) + _archived_gain
 
             # Get 6m gain for this market
             _left = right - dt.timedelta(days=186)
@@ -182,6 +184,9 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['6m_gain'] = _res[0].get('sum')
+            _archived_count, _archived_gain = archived_closures(db, position['market'], _left)
+            if _archived_count > 0:
+                markets[_key]['6m_gain'] = (markets[_key]['6m_gain'] or 0) + _archived_gain
 
             # Get 1y gain for this market
             _left = right - dt.timedelta(days=365)
@@ -197,12 +202,16 @@ try:
             _res = list(cursor)
             if len(_res) > 0:
                 markets[_key]['1y_gain'] = _res[0].get('sum')
+            _archived_count, _archived_gain = archived_closures(db, position['market'], _left)
+            if _archived_count > 0:
+                markets[_key]['1y_gain'] = (markets[_key]['1y_gain'] or 0) + _archived_gain
 
             # Get position counts for this market
             markets[_key]['open_positions'] = db.positions.count_documents({'status': 'open', 'market': position['market']})
             markets[_key]['opening_positions'] = db.positions.count_documents({'status': 'opening', 'market': position['market']})
             markets[_key]['closing_positions'] = db.positions.count_documents({'status': 'closing', 'market': position['market']})
-            markets[_key]['closed_positions'] = db.positions.count_documents({'status': 'closed', 'market': position['market']})
+            markets[_key]['closed_positions'] = db.positions.count_documents({'status': 'closed', 'market': position['market']}) \
+                + _archived_closed_positions
 
         markets[_key] = {
             'closed_last_hour': markets[_key]['closed_last_hour'] + 1,
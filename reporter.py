@@ -1,16 +1,9 @@
 """
 This script pushes trading stats to DB
 """
-import yaml
 import argparse
 import datetime as dt
 import time
-from pymongo import MongoClient
-
-from bittrex.bittrex import Bittrex, API_V2_0, API_V1_1
-
-from binance.client import Client as Binance
-from binance.enums import *
 
 parser = argparse.ArgumentParser(description='Calculates trading stats and persist them to reports collection')
 parser.add_argument('--exchange', choices=['bittrex', 'binance'], required=True,
@@ -20,6 +13,12 @@ parser.add_argument('--config', type=str, required=False, default="config.yml",
 
 args = parser.parse_args()
 
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from pymongo import MongoClient
+
+from dumbot.archive import archived_closures
+
 try:
     if args.exchange != 'binance':
         raise NotImplementedError("Reported is only implemeted for Binance exchanges")
@@ -29,22 +28,19 @@ try:
 
     # Initialize mongo api
     mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
     db = mongo[config.get('db_name', 'dumbot')]
 
     # Exchange API keys
     API_KEY = config.get('%s_api_key' % args.exchange, None)
     API_SECRET = config.get('%s_api_secret' % args.exchange, None)
 
-    # Initialize exchange api
+    # Initialize exchange api, exchange libraries are only imported when used
     if args.exchange == 'bittrex':
+        from bittrex.bittrex import Bittrex, API_V1_1
         api = Bittrex(API_KEY, API_SECRET, api_version=API_V1_1)
     elif args.exchange == 'binance':
+        from binance.client import Client as Binance
         api = Binance(API_KEY, API_SECRET)
-
-        # Is binance alive ?
-        if api.get_system_status().get("status", -1) != 0:
-            raise Exception("Exchange unavailable for trading")
     else:
         raise NotImplementedError
 
@@ -63,7 +59,12 @@ try:
             "sum": {"$sum": "$net"}
         }}
     ]);
-    _cumulated_gain = list(cursor)[0].get('sum')
+    _res = list(cursor)
+    _cumulated_gain = _res[0].get('sum') if len(_res) > 0 else 0
+
+    # Add the gain of archived positions
+    _archived_closed_positions, _archived_gain = archived_closures(db)
+    _cumulated_gain += _archived_gain
 
     # Get gain at stop loss
     cursor = db.positions.aggregate([
@@ -92,7 +93,7 @@ try:
     _open_positions = db.positions.count_documents({'status': 'open'})
     _opening_positions = db.positions.count_documents({'status': 'opening'})
     _closing_positions = db.positions.count_documents({'status': 'closing'})
-    _closed_positions = db.positions.count_documents({'status': 'closed'})
+    _closed_positions = db.positions.count_documents({'status': 'closed'}) + _archived_closed_positions
 
     # Get investment value
     cursor = db.positions.aggregate([
@@ -128,6 +129,25 @@ try:
     if _drawdown is not None:
         _doc['drawdown'] = _drawdown
 
+    # Consolidated positions are also broken down per broker and account
+    cursor = db.positions.aggregate([
+        {"$match": {'status': 'open'}},
+        {"$group": {
+            "_id": {"broker": "$broker", "account": {"$ifNull": ["$account", "default"]}},
+            "gain_now": {"$sum": "$expected_net"},
+            "balance": {"$sum": "$open_cost_proceeds"},
+            "open_positions": {"$sum": 1}
+        }}
+    ]);
+    _doc['brokers'] = [{
+        "broker": _r['_id']['broker'],
+        "account": _r['_id']['account'],
+        "gain_now": _r['gain_now'],
+        "balance": _r['balance'],
+        "equity": _r['balance'] + _r['gain_now'],
+        "open_positions": _r['open_positions'],
+    } for _r in cursor]
+
     db.reports.insert_one(_doc)
 except Exception as e:
     print("Error: %s" % e)
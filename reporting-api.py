@@ -0,0 +1,193 @@
+"""
+This script serves the reports and positions as a read-only JSON HTTP API.
+
+Reports, assets, closures and pending positions are kept in memory and reloaded
+on change only (see dumbot.settings_cache), responses are encoded once per
+reload and carry an ETag, so dashboards cost the database nothing per request.
+
+    GET /report                     last portfolio report
+    GET /assets                     per asset balances
+    GET /closures[?market=BTCUSDT]  last per market closure stats
+    GET /exposure                   running exposure totals per account
+    GET /positions[?status=open&market=BTCUSDT&page=1&per_page=100]
+"""
+import json
+import argparse
+import threading
+import time
+import datetime as dt
+import urllib.parse
+
+parser = argparse.ArgumentParser(description='Read-only reporting HTTP API.')
+parser.add_argument('--config', type=str, required=False, default="config.yml",
+                    help='Config file')
+parser.add_argument('--host', type=str, required=False, default='127.0.0.1',
+                    help='Address to listen on')
+parser.add_argument('--port', type=int, required=False, default=8080,
+                    help='Port to listen on')
+parser.add_argument('--positions-interval', type=float, required=False, default=5,
+                    help='Minimum seconds between two updates of the cached positions')
+parser.add_argument('--max-per-page', type=int, required=False, default=500,
+                    help='Maximum positions per page')
+
+args = parser.parse_args()
+
+# Imported once the command line is parsed, so that --help and argument errors return at once
+import yaml
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bson import ObjectId
+from pymongo import MongoClient
+
+from dumbot.settings_cache import SettingsCache, IncrementalCache, LatestDocumentCache
+from dumbot.checkpoint import supervise
+
+PENDING_STATUSES = ['opening', 'open', 'closing']
+# Encoded representations kept per resource and version
+MAX_BODIES = 1000
+# ETags stay unique across restarts
+STARTED_AT = int(time.time())
+
+
+def to_json(value):
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError("%s is not JSON serializable" % type(value))
+
+
+class Resource(object):
+    """JSON representations of a cache, encoded once per cache version"""
+    def __init__(self, cache, render):
+        self.cache = cache
+        self.render = render
+        self.version = None
+        self.bodies = {}
+        self._lock = threading.Lock()
+
+    def get(self, params):
+        """Return (etag, body) of the representation for `params`"""
+        with self._lock:
+            if self.version != self.cache.version:
+                self.version = self.cache.version
+                self.bodies = {}
+            key = tuple(sorted(params.items()))
+            if key not in self.bodies:
+                # Bound the memory used by arbitrary query strings
+                if len(self.bodies) >= MAX_BODIES:
+                    self.bodies = {}
+                body = json.dumps(self.render(self.cache.documents(), params), default=to_json).encode('utf-8')
+                self.bodies[key] = ('"%x-%d"' % (STARTED_AT, self.version), body)
+            return self.bodies[key]
+
+
+def render_report(documents, params):
+    return documents.get('latest')
+
+
+def render_assets(documents, params):
+    return sorted(documents.values(), key=lambda _a: _a.get('asset'))
+
+
+def render_closures(documents, params):
+    report = documents.get('latest') or {}
+    if 'market' in params:
+        return (report.get('pairs') or {}).get(params['market'])
+    return report
+
+
+def render_exposure(documents, params):
+    return sorted(documents.values(), key=lambda _e: _e.get('_id'))
+
+
+def render_positions(documents, params):
+    positions = documents.values()
+    if 'status' in params:
+        positions = [_p for _p in positions if _p.get('status') == params['status']]
+    if 'market' in params:
+        positions = [_p for _p in positions if _p.get('market') == params['market']]
+    positions = sorted(positions, key=lambda _p: _p.get('open_at') or dt.datetime.min, reverse=True)
+
+    page = max(int(params.get('page', 1)), 1)
+    per_page = min(max(int(params.get('per_page', 100)), 1), args.max_per_page)
+    return {
+        'total': len(positions),
+        'page': page,
+        'per_page': per_page,
+        'positions': positions[(page - 1) * per_page:page * per_page],
+    }
+
+
+def make_handler(resources):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            resource = resources.get(url.path.rstrip('/'))
+            if resource is None:
+                return self.send_error(404)
+
+            try:
+                params = dict(urllib.parse.parse_qsl(url.query))
+                etag, body = resource.get(params)
+            except ValueError as e:
+                return self.send_error(400, str(e))
+
+            if etag in [_e.strip() for _e in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def run():
+    # Load configuration
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+    # Initialize mongo api
+    mongo = MongoClient(config.get('db', None))
+    mongo.server_info()
+    db = mongo[config.get('db_name', 'dumbot')]
+
+    caches = [
+        LatestDocumentCache(db.reports),
+        SettingsCache(db.reports_assets, {}, key='asset'),
+        LatestDocumentCache(db.reports_closures),
+        # Published every trailing stoploss cycle
+        SettingsCache(db.exposure, {}, key='_id', min_interval=args.positions_interval),
+        # Positions change on every price move, their changes are applied at most every few seconds
+        IncrementalCache(db.positions, {'status': {'$in': PENDING_STATUSES}},
+                         lambda _p: _p.get('status') in PENDING_STATUSES, min_interval=args.positions_interval),
+    ]
+    resources = dict(zip(['/report', '/assets', '/closures', '/exposure', '/positions'], [
+        Resource(cache.start(), render) for cache, render in
+        zip(caches, [render_report, render_assets, render_closures, render_exposure, render_positions])]))
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(resources))
+    print("%s - Serving on http://%s:%s" % (dt.datetime.now(), args.host, args.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        for cache in caches:
+            cache.stop()
+
+
+try:
+    supervise(run, 'Reporting API')
+except Exception as e:
+    print("%s - Error: %s" % (dt.datetime.now(), e))
+finally:
+    print("%s - Stopped" % dt.datetime.now())
@@ -1,25 +1,39 @@
 """
 This script will open a new position no matter the price.
 
-It is based on the market_settings collection
+It is based on the scalping_settings collection, settings are cached in memory
+and reloaded on change. Prices and balances are streamed from Binance websockets
+so thresholds are evaluated as soon as the price moves.
 """
 import yaml
 import argparse
+import threading
 import time
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
 
-from binance.client import Client as Binance
-from binance.enums import *
+from dumbot.settings_cache import SettingsCache
+from dumbot.exchange import refresh_exchange_symbols
+from dumbot.checkpoint import Checkpoint, supervise
+from dumbot.exposure import ExposureCaps
 
 parser = argparse.ArgumentParser(description='Scalper bot.')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
+parser.add_argument('--cooldown', type=int, required=False, default=60,
+                    help='Minimum seconds between two orders on the same market')
+parser.add_argument('--checkpoint', type=str, required=False, default='scalper.checkpoint',
+                    help='Warm state snapshot file')
 
 args = parser.parse_args()
 exchange = 'binance'
 
-try:
+checkpoint = Checkpoint(args.checkpoint)
+state = checkpoint.load()
+
+
+def run():
     # Load configuration
     config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
 
@@ -31,56 +45,127 @@ try:
     # Exchange API keys
     API_KEY = config.get('%s_api_key' % exchange, None)
     API_SECRET = config.get('%s_api_secret' % exchange, None)
-    SLEEP_SECONDS = 60
-
-    while True:
-        # Re-Initialize binance api
-        api = Binance(API_KEY, API_SECRET)
-
-        # Is binance alive ?
-        if api.get_system_status().get("status", -1) != 0:
-            raise Exception("Exchange unavailable for trading")
-
-        # Scalping in progress:
-        for market in db.scalping_settings.find({"scalping": True}):
+    ORDER_COOLDOWN_SECONDS = args.cooldown
+
+    # Initialize binance api, imported once the command line is parsed
+    from binance.client import Client as Binance
+    from binance.enums import SIDE_BUY, SIDE_SELL, ORDER_TYPE_MARKET
+    from binance import ThreadedWebsocketManager
+    api = Binance(API_KEY, API_SECRET)
+
+    # Is binance alive ?
+    if api.get_system_status().get("status", -1) != 0:
+        raise Exception("Exchange unavailable for trading")
+
+    # Order quantities are floored to the LOT_SIZE step of each market,
+    # exchange info is restored from the checkpoint if fresh enough
+    exchange_state = state.setdefault('exchanges', {}).setdefault(exchange, {})
+    _exchange_symbols, quantizer = refresh_exchange_symbols(exchange_state, api)
+
+    # Scalping settings, reloaded on change only
+    settings = SettingsCache(db.scalping_settings, {"scalping": True}).start()
+
+    # Exposure published by the trailing stoploss loops, followed only when caps are configured
+    caps = ExposureCaps(config.get('exposure_caps', None))
+    exposure = SettingsCache(db.exposure, {'exchange': exchange}, key='_id', min_interval=5).start() \
+        if caps.enabled else None
+
+    # Balances snapshot, then kept up to date by account update events
+    balances = {}
+    for _b in api.get_account().get('balances', []):
+        balances[_b['asset']] = float(_b['free'])
+
+    # Orders are placed from a pool so the websocket thread never blocks
+    executor = ThreadPoolExecutor(max_workers=4)
+    # Cooldowns survive restarts so a restart never doubles an order
+    last_order_at = state.setdefault('last_order_at', {})
+    orders_lock = threading.Lock()
+
+    def place_order(market, side, quantity, ticker):
+        try:
+            print('%s %s, amount: %s and lastPrice: %s' % (
+                'Opening' if side == SIDE_BUY else 'Closing all positions', market, quantity, ticker))
+
+            r = api.create_order(
+                symbol=market,
+                side=side,
+                type=ORDER_TYPE_MARKET,
+                quantity=quantizer.format_qty(market, quantity))
+            print('.. order details: %s' % r)
+        except Exception as e:
+            print("%s - Error while placing order on market %s: %s" % (dt.datetime.now(), market, e))
+
+    def handle_ticker(market, ticker):
+        settings_market = settings.get(market)
+        if settings_market is None:
+            return
+
+        # Do not flood the market while the previous order settles
+        with orders_lock:
+            if time.time() - last_order_at.get(market, 0) < ORDER_COOLDOWN_SECONDS:
+                return
+
+            balance = balances.get(settings_market['asset'], 0)
+
+            if settings_market.get('opening', False) and ticker <= settings_market['opening_threshold'] and \
+                    balance < settings_market['max_asset_value']:
+                if exposure is not None:
+                    reason = caps.exceeded(exposure.documents().values(), market, settings_market['asset'],
+                                           settings_market['opening_usdt_amount'])
+                    if reason is not None:
+                        # Checked again after the cooldown
+                        last_order_at[market] = time.time()
+                        print("%s - %s not opened: %s" % (dt.datetime.now(), market, reason))
+                        return
+
+                # Open new position:
+                last_order_at[market] = time.time()
+                checkpoint.save(state)
+                executor.submit(place_order, market, SIDE_BUY, settings_market['opening_usdt_amount'], ticker)
+            elif ticker >= settings_market['closing_threshold'] and balance > 0:
+                # Close on negative valuation
+                last_order_at[market] = time.time()
+                checkpoint.save(state)
+                executor.submit(place_order, market, SIDE_SELL, balance, ticker)
+
+    def handle_prices(msg):
+        # All markets mini ticker: [{'s': 'BTCUSDT', 'c': '9500.01', ...}, ...]
+        if isinstance(msg, dict):
+            if msg.get('e') == 'error':
+                print("%s - Price stream error: %s" % (dt.datetime.now(), msg))
+            return
+
+        for _t in msg:
             try:
-                # Get ticker lastPrice and asset balance
-                r = api.get_ticker(symbol=market['market'])
-                ticker = float(r.get('lastPrice', None))
-                balance = float(api.get_asset_balance(market['asset']).get('free', 0))
-                print('%s: %s' % (market['market'], ticker))
-
-                if market.get('opening', False) and ticker <= market['opening_threshold'] and \
-                        balance < market['max_asset_value']:
-                    # Open new position:
-                    print('Opening %s, amount: %s and lastPrice: %s' % (
-                        market['market'], market['opening_usdt_amount'], ticker))
-
-                    r = api.create_order(
-                        symbol=market['market'],
-                        side=SIDE_BUY,
-                        type=ORDER_TYPE_MARKET,
-                        quantity=market['opening_usdt_amount'])
-                    print('.. order details: %s' % r)
-
-                if ticker >= market['closing_threshold']:
-                    if balance > 0:
-                        # Close on negative valuation
-                        print('Closing all positions %s, amount: %s and lastPrice: %s' % (
-                            market['market'], balance, ticker))
-
-                        r = api.create_order(
-                            symbol=market['market'],
-                            side=SIDE_SELL,
-                            type=ORDER_TYPE_MARKET,
-                            quantity=balance)
-                        print('.. order details: %s' % r)
+                handle_ticker(_t['s'], float(_t['c']))
             except Exception as e:
-                print("%s - Error in loop 1 with market %s: %s" % (
-                    dt.datetime.now(), market['market'], e))
+                print("%s - Error in price handling with market %s: %s" % (
+                    dt.datetime.now(), _t.get('s'), e))
+
+    def handle_account(msg):
+        if msg.get('e') == 'outboundAccountPosition':
+            for _b in msg.get('B', []):
+                balances[_b['a']] = float(_b['f'])
+        elif msg.get('e') == 'error':
+            print("%s - Account stream error: %s" % (dt.datetime.now(), msg))
+
+    twm = ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET)
+    try:
+        twm.start()
+        twm.start_miniticker_socket(callback=handle_prices)
+        twm.start_user_socket(callback=handle_account)
+        twm.join()
+        raise Exception("Websocket manager stopped")
+    finally:
+        twm.stop()
+        settings.stop()
+        if exposure is not None:
+            exposure.stop()
+        executor.shutdown(wait=False)
 
-        time.sleep(SLEEP_SECONDS)
 
+try:
+    supervise(run, 'Scalper')
 except Exception as e:
     print("%s - Error: %s" % (dt.datetime.now(), e))
 finally:
@@ -4,194 +4,334 @@ import datetime as dt
 import yaml
 import argparse
 import time
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
 
-from bittrex.bittrex import Bittrex, API_V2_0, API_V1_1
-
-from binance.client import Client as Binance
-from binance.enums import *
+from dumbot.brokers import make_broker, BROKERS
+from dumbot.positions import find_positions, SYNC_FIELDS
+from dumbot.price_history import changed
+from dumbot.checkpoint import Checkpoint, supervise
+from dumbot.accounts import load_accounts, account_filter
+from dumbot.price_cache import PriceCache, cache_path
+from dumbot.replay import Harness
+from dumbot.profiler import SamplingProfiler
+from dumbot.order_polling import PollSchedule
 
 parser = argparse.ArgumentParser(description='Order synchronization bot.')
-parser.add_argument('--exchange', choices=['bittrex', 'binance'], required=True,
-                    help='Exchange to use')
+parser.add_argument('--exchange', choices=sorted(BROKERS.keys()), required=False, default=None,
+                    help='Exchange to use, defaults to every exchange having an account in config')
+parser.add_argument('--accounts', type=str, required=False, default=None,
+                    help='Comma separated accounts to manage, defaults to every account of the exchange(s)')
 parser.add_argument('--config', type=str, required=False, default="config.yml",
                     help='Config file')
+parser.add_argument('--write-epsilon', type=float, required=False, default=0.001,
+                    help='Relative price change below which pending positions are not updated')
+parser.add_argument('--price-max-age', type=float, required=False, default=10,
+                    help='Age in seconds above which host price cache prices are ignored, 0 disables the cache')
+parser.add_argument('--workers', type=int, required=False, default=4,
+                    help='Maximum number of markets checked in parallel')
+parser.add_argument('--min-check-interval', type=float, required=False, default=5,
+                    help='Seconds between two checks of a fresh order, or of an order close to its price')
+parser.add_argument('--max-check-interval', type=float, required=False, default=120,
+                    help='Maximum seconds between two checks of an order')
+parser.add_argument('--check-backoff', type=float, required=False, default=0.1,
+                    help='Seconds added to the check interval of an order per second of age')
+parser.add_argument('--proximity-percent', type=float, required=False, default=0.5,
+                    help='Orders priced within this percent of the last price are checked every min interval')
+parser.add_argument('--record', type=str, required=False, default=None,
+                    help='Record exchange calls and database reads to this file (see dumbot.replay)')
+parser.add_argument('--replay', type=str, required=False, default=None,
+                    help='Replay a recording instead of connecting to the exchanges and the database')
+parser.add_argument('--replay-pace', action='store_true',
+                    help='Replay at the recorded pace instead of full speed')
+parser.add_argument('--profile-dir', type=str, required=False, default='profiles',
+                    help='Sampling profiler output, toggled with SIGUSR1 or <profile-dir>/ENABLED (see dumbot.profiler)')
+parser.add_argument('--checkpoint', type=str, required=False, default=None,
+                    help='Warm state snapshot file, defaults to update-ing-orders-<exchange|all>.checkpoint')
 
 args = parser.parse_args()
+if args.checkpoint is None:
+    args.checkpoint = 'update-ing-orders-%s.checkpoint' % (args.exchange or 'all')
 
-try:
-    # Load configuration
-    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+checkpoint = Checkpoint(args.checkpoint)
+harness = Harness(args.record, args.replay, args.replay_pace)
+# A replay starts from the state saved in the recording
+state = harness.state(None if harness.replaying else checkpoint.load())
+profiler = SamplingProfiler(args.profile_dir).start()
 
-    # Initialize mongo api
-    mongo = MongoClient(config.get('db', None))
-    mongo.server_info()
-    db = mongo[config.get('db_name', 'dumbot')]
+# One open orders listing (weight 6) costs less than checking two orders (weight 4 each)
+BATCH_MIN_ORDERS = 2
+# Seconds after which a position claimed for closure without close order is reported
+CLAIM_WARNING = 60
 
-    # Exchange API keys
-    API_KEY = config.get('%s_api_key' % args.exchange, None)
-    API_SECRET = config.get('%s_api_secret' % args.exchange, None)
-    SLEEP_SECONDS = 5
 
-    # Initialize exchange api
-    if args.exchange == 'bittrex':
-        api = Bittrex(API_KEY, API_SECRET, api_version=API_V1_1)
-    elif args.exchange == 'binance':
-        api = Binance(API_KEY, API_SECRET)
-
-        # Is binance alive ?
-        if api.get_system_status().get("status", -1) != 0:
-            raise Exception("Exchange unavailable for trading")
+def pending_order(position):
+    """(order id, order price, placed at) of the pending order of `position`"""
+    if position.status == 'opening':
+        return position.open_order_id, position.open_rate, position.open_at
+    return position.close_order_id, position.close_rate, position.closed_at
+
+
+def cached_price(broker, last_prices, market):
+    """Price of `market` known without request: from the host price cache or the last check"""
+    if broker.price_cache is not None:
+        price = broker.price_cache.price(market, broker.price_max_age)
+        if price is not None:
+            return price
+    return last_prices.get(market, (None, 0))[0]
+
+
+def sync_position(db, broker, position, order, last_price):
+    """Update `position` from the status of its pending `order`"""
+    # A sell shared by several positions (see close_positions in automatic-trailing-stoploss.py)
+    # is split back to each position by volume
+    share = 1
+    if position.status == 'closing' and position.close_group_volume:
+        # Positions closed before close_volume was recorded summed their raw volumes
+        share = (position.close_volume or position.volume) / position.close_group_volume
+
+    order_price = order['price'] * share
+    order_type = order['type']
+    order_is_open = order['is_open']
+    order_remaining_quantity = order['remaining_quantity'] * share
+    order_cancel_initiated = order['cancel_initiated']
+    order_commission_paid = order['commission_paid'] * share
+
+    # We handle only LIMIT orders
+    if order_type not in ['LIMIT_BUY', 'LIMIT_SELL']:
+        raise Exception("Order type rejected for this position: %s" % order_type)
+
+    # Are we still in an 'ing' status ?
+    if order_is_open:
+        if position.remaining_volume == order_remaining_quantity and \
+                not changed(position.current_price, last_price, args.write_epsilon):
+            return
+
+        db.positions.update_one({'_id': position.id}, {
+            '$set': {
+                'remaining_volume': order_remaining_quantity,
+                'current_price': last_price,
+                'price_at': dt.datetime.utcnow(),
+                'last_update_at': dt.datetime.utcnow(),
+            }})
     else:
-        raise NotImplementedError
-
-    # Get exchange_info
-    exchange_info = api.get_exchange_info()
-
-    # Build exchange symbols configuration
-    exchange_symbols = {}
-    r = api.get_exchange_info()
-    for symbol in exchange_info.get('symbols'):
-        # Rebuild the filters array
-        filters = {}
-        for filter in symbol['filters']:
-            filters[filter['filterType']] = filter
-        symbol['filters'] = filters
-
-        exchange_symbols[symbol.get('symbol')] = symbol
-
-    while True:
-        ticker_cache = {}
-        for position in db.positions.find({"$and":[
-            {"status": {"$in": ["opening", "closing"]}},
-            {"broker": args.exchange}
-        ]}):
+        paid_commission = (position.paid_commission or 0) + order_commission_paid
+        if not order_cancel_initiated:
+            # Order complete:
+            #########################################
+            db.positions.update_one({'_id': position.id}, {
+                '$set': {
+                    'status': 'open' if order_type == 'LIMIT_BUY' else 'closed',
+                    'paid_commission': paid_commission,
+                    'remaining_volume': order_remaining_quantity,
+                    'last_update_at': dt.datetime.utcnow(),
+                }})
+
+            if order_type == 'LIMIT_SELL':
+                # If we're closing then update the net
+                _close_cost_proceeds = order_price - order_commission_paid
+                _net = _close_cost_proceeds - (position.open_cost_proceeds or 0)
+                _net_percent = ((_close_cost_proceeds * 100) / (position.open_cost_proceeds or 0)) - 100
+                db.positions.update_one({'_id': position.id}, {
+                    '$set': {
+                        'fully_closed_at': dt.datetime.utcnow(),
+                        'close_commission': order_commission_paid,
+                        'close_cost': order_price,
+                        'close_cost_proceeds': _close_cost_proceeds,
+                        'net': _net,
+                        'net_percent': _net_percent,
+                        'last_update_at': dt.datetime.utcnow(),
+                    }})
+            else:
+                # Get the volume from executed trades
+                _volume = position.volume - broker.trades_commission(position.market,
+                                                                     position.open_order_id)
+
+                # If we're opening then update the open_costs
+                _open_cost_proceeds = order_price + order_commission_paid
+                db.positions.update_one({'_id': position.id}, {
+                    '$set': {
+                        'requested_volume': position.volume,
+                        'volume': round(_volume, 8),
+                        'fully_open_at': dt.datetime.utcnow(),
+                        'open_commission': order_commission_paid,
+                        'open_cost': order_price,
+                        'open_cost_proceeds': _open_cost_proceeds,
+                        'last_update_at': dt.datetime.utcnow(),
+                    }})
+        else:
+            # Order cancelled:
+            #########################################
+            db.positions.update_one({'_id': position.id}, {
+                '$set': {
+                    'status': 'opening-cancelled' if order_type == 'LIMIT_BUY' else 'closing-cancelled',
+                    'paid_commission': paid_commission,
+                    'remaining_volume': order_remaining_quantity,
+                    'last_update_at': dt.datetime.utcnow(),
+                }})
+
+        print(" > Order completed")
+
+
+def sync_market(db, broker, account, schedule, market, positions, last_prices):
+    """Check the pending orders of `positions` on `market` and update the positions
+
+    Several orders are read from one open orders listing, the orders missing from
+    it (filled or cancelled since) are then requested one by one.
+    """
+    order_ids = list(dict.fromkeys(pending_order(_p)[0] for _p in positions))
+    orders = {}
+    if len(order_ids) >= BATCH_MIN_ORDERS:
+        try:
+            orders = broker.open_orders(market)
+        except Exception as e:
+            print("[%s/%s] Cannot list %s open orders: %s" % (account['exchange'], account['name'], market, e))
+
+    errors = {}
+    for order_id in order_ids:
+        if order_id not in orders:
             try:
-                print(" > [%s] %s %s (%s)" % (
-                    args.exchange, position.get('_id'), position.get('market'), position.get('status')))
-
-                # Get order_id
-                order_id = position.get('open_order_id') if position.get('status') == 'opening' \
-                    else position.get('close_order_id')
-
-                # Get order status from broker
-                if args.exchange == 'bittrex':
-                    r = api.get_order(order_id)
-                    if not r.get('success', False):
-                        raise Exception("Cannot get order %s: %s" % (order_id, r))
-                    order_price = r.get('result', {}).get('Price', 0)
-                    order_type = r.get('result', {}).get('Type', None)
-                    order_is_open = r.get('result', {}).get('IsOpen', False)
-                    order_remaining_quantity = r.get('result', {}).get('QuantityRemaining', 0)
-                    order_cancel_initiated = r.get('result', {}).get('CancelInitiated', False)
-                    order_commission_paid = r.get('result', {}).get('CommissionPaid', 0)
-                elif args.exchange == 'binance':
-                    r = api.get_order(symbol=position.get('market'), orderId=order_id)
-                    if r.get('orderId', None) != order_id or 'type' not in r:
-                        raise Exception("Cannot get order %s: %s" % (order_id, r))
-                    order_price = float(r.get('cummulativeQuoteQty', 0))
-                    order_type = '%s_%s' % (r.get('type', 'ND'), r.get('side', 'ND'))
-                    order_is_open = True if r.get('status', False) in ['PARTIALLY_FILLED', 'PENDING_CANCEL', 'NEW'] else False
-                    order_remaining_quantity = float(r.get('origQty', 0)) - float(r.get('executedQty', 0))
-                    order_cancel_initiated = r.get('PENDING_CANCEL', False)
-                    # @TODO: Will not calculate commission with Binance because of BNB fees complexity
-                    order_commission_paid = 0
-
-                # We handle only LIMIT orders
-                if order_type not in ['LIMIT_BUY', 'LIMIT_SELL']:
-                    raise Exception("Order type rejected for this position: %s" % order_type)
-
-                # Get ticker value
-                if position.get('market') not in ticker_cache:
-                    if args.exchange == 'bittrex':
-                        r = api.get_ticker(position.get('market'))
-                        ticker_cache[position.get('market')] = r.get('result', {}).get('Last', None)
-                    elif args.exchange == 'binance':
-                        r = api.get_ticker(symbol=position.get('market'))
-                        ticker_cache[position.get('market')] = r.get('lastPrice', None)
-                    if ticker_cache[position.get('market')] is None:
-                        print("Cannot get last ticker value for %s" % (position.get('market')))
-                        continue
-                    else:
-                        ticker_cache[position.get('market')] = float(ticker_cache[position.get('market')])
-
-                _LAST_TICKER_VALUE = ticker_cache[position.get('market')]
-
-                # Are we still in an 'ing' status ?
-                if order_is_open:
-                    db.positions.update_one({'_id': position.get('_id')}, {
-                        '$set': {
-                            'remaining_volume': order_remaining_quantity,
-                            'current_price': _LAST_TICKER_VALUE,
-                            'price_at': dt.datetime.utcnow(),
-                            'last_update_at': dt.datetime.utcnow(),
-                        }})
-                else:
-                    paid_commission = position.get('paid_commission', 0) + order_commission_paid
-                    if not order_cancel_initiated:
-                        # Order complete:
-                        #########################################
-                        db.positions.update_one({'_id': position.get('_id')}, {
-                            '$set': {
-                                'status': 'open' if order_type == 'LIMIT_BUY' else 'closed',
-                                'paid_commission': paid_commission,
-                                'remaining_volume': order_remaining_quantity,
-                                'last_update_at': dt.datetime.utcnow(),
-                            }})
-
-                        if order_type == 'LIMIT_SELL':
-                            # If we're closing then update the net
-                            _close_cost_proceeds = order_price - order_commission_paid
-                            _net = _close_cost_proceeds - position.get('open_cost_proceeds', 0)
-                            _net_percent = ((_close_cost_proceeds * 100) / position.get('open_cost_proceeds', 0)) - 100
-                            db.positions.update_one({'_id': position.get('_id')}, {
-                                '$set': {
-                                    'fully_closed_at': dt.datetime.utcnow(),
-                                    'close_commission': order_commission_paid,
-                                    'close_cost': order_price,
-                                    'close_cost_proceeds': _close_cost_proceeds,
-                                    'net': _net,
-                                    'net_percent': _net_percent,
-                                    'last_update_at': dt.datetime.utcnow(),
-                                }})
-                        else:
-                            # Get the volume from executed trades
-                            trades = api.get_my_trades(symbol=position.get('market'),
-                                                       orderId=position.get('open_order_id'))
-                            _volume = position.get('volume')
-                            for trade in trades:
-                                _volume -= float(trade.get('commission', 0))
-
-                            # If we're opening then update the open_costs
-                            _open_cost_proceeds = order_price + order_commission_paid
-                            db.positions.update_one({'_id': position.get('_id')}, {
-                                '$set': {
-                                    'requested_volume': position.get('volume'),
-                                    'volume': round(_volume, 8),
-                                    'fully_open_at': dt.datetime.utcnow(),
-                                    'open_commission': order_commission_paid,
-                                    'open_cost': order_price,
-                                    'open_cost_proceeds': _open_cost_proceeds,
-                                    'last_update_at': dt.datetime.utcnow(),
-                                }})
-                    else:
-                        # Order cancelled:
-                        #########################################
-                        db.positions.update_one({'_id': position.get('_id')}, {
-                            '$set': {
-                                'status': 'opening-cancelled' if order_type == 'LIMIT_BUY' else 'closing-cancelled',
-                                'paid_commission': paid_commission,
-                                'remaining_volume': order_remaining_quantity,
-                                'last_update_at': dt.datetime.utcnow(),
-                            }})
-
-                    print(" > Order completed")
+                orders[order_id] = broker.get_order(market, order_id)
             except Exception as e:
-                print("Error in position handling: %s" % e)
-                continue
+                errors[order_id] = e
+
+    # Get ticker value
+    last_price, _volume = broker.last_price(market)
+    if last_price is None:
+        print("Cannot get last ticker value for %s" % market)
+        return
+    with checkpoint.lock:
+        last_prices[market] = (last_price, time.time())
 
-        time.sleep(SLEEP_SECONDS)
+    for position in positions:
+        order_id, order_rate, placed_at = pending_order(position)
+        try:
+            print(" > [%s/%s] %s %s (%s)" % (
+                account['exchange'], account['name'], position.id, position.market, position.status))
+            if order_id in errors:
+                raise errors[order_id]
+            sync_position(db, broker, position, orders[order_id], last_price)
+        except Exception as e:
+            print("[%s/%s] Error in position handling: %s" % (account['exchange'], account['name'], e))
+            continue
+
+        age = (dt.datetime.utcnow() - placed_at).total_seconds() if placed_at is not None else 0
+        schedule.checked(order_id, age, schedule.near(order_rate, last_price))
+
+
+def run_account(db, account, price_cache_path):
+    """Order synchronization loop of one exchange account"""
+    SLEEP_SECONDS = 5
+
+    # Initialize exchange api
+    # Recorded and replayed runs read prices from the exchange only
+    use_price_cache = args.price_max_age > 0 and not harness.active
+    # The state is shared with the other accounts and saved by the main thread
+    with checkpoint.lock:
+        broker = make_broker(account, state, PriceCache.open(price_cache_path) if use_price_cache else None,
+                             args.price_max_age, harness)
+        account_state = state.setdefault('accounts', {}).setdefault(
+            '%s/%s' % (account['exchange'], account['name']), {})
+        last_prices = account_state.setdefault('last_prices', {})
+    db = harness.database(db, 'mongo/%s/%s' % (account['exchange'], account['name']))
+
+    # Next check of each pending order (see dumbot.order_polling), recorded and replayed
+    # runs check every order every cycle so that replays never depend on timing
+    schedule = PollSchedule(args.min_check_interval, args.max_check_interval if not harness.active else 0,
+                            args.check_backoff, args.proximity_percent)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        while True:
+            profiler.begin_cycle()
+            positions_count = 0
+            pending_orders = set()
+            due = {}
+            for position in find_positions(db.positions, {"$and": [
+                {"status": {"$in": ["opening", "closing"]}},
+                {"broker": account['exchange']},
+                account_filter(account)
+            ]}, SYNC_FIELDS):
+                positions_count += 1
+                order_id, order_rate, _placed_at = pending_order(position)
+                if order_id is None:
+                    # Claimed by the trailing stoploss while it places the sell, never released
+                    # automatically once stuck as the sell may have been placed
+                    if position.close_claimed_at is not None and \
+                            (dt.datetime.utcnow() - position.close_claimed_at).total_seconds() > CLAIM_WARNING:
+                        print("[%s/%s] Position %s claimed by %s at %s has no close order, check it manually" % (
+                            account['exchange'], account['name'], position.id, position.close_claimed_by,
+                            position.close_claimed_at))
+                    continue
+                pending_orders.add(order_id)
+                _near = schedule.near(order_rate, cached_price(broker, last_prices, position.market))
+                if schedule.due(order_id, _near):
+                    due.setdefault(position.market, []).append(position)
+            schedule.retain(pending_orders)
+
+            # Markets are checked concurrently, the rate budget paces the requests,
+            # the pool threads are profiled as part of this account cycle
+            cycle_owner = threading.get_ident()
+            futures = [(_m, executor.submit(profiler.run_in_cycle, cycle_owner, sync_market,
+                                            db, broker, account, schedule, _m, _p, last_prices))
+                       for _m, _p in due.items()]
+            for market, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print("[%s/%s] Error in %s orders handling: %s" % (account['exchange'], account['name'], market, e))
+
+            profiler.end_cycle(positions=positions_count)
+            harness.sleep(SLEEP_SECONDS)
+    finally:
+        executor.shutdown(wait=False)
+        # A restarted loop builds a new broker, stop the threads of this one
+        broker.close()
+
+
+def run():
+    # Load configuration
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.SafeLoader)
+
+    # Initialize mongo api, replays never connect
+    db = None
+    if not harness.replaying:
+        mongo = MongoClient(config.get('db', None))
+        mongo.server_info()
+        db = mongo[config.get('db_name', 'dumbot')]
+
+    # Exchange accounts
+    accounts = load_accounts(config, args.exchange, args.accounts.split(',') if args.accounts else None)
+    if len(accounts) == 0:
+        raise Exception("No %s account configured" % (args.exchange or 'exchange'))
+
+    # One concurrent loop per account
+    tasks = []
+    for account in accounts:
+        task = threading.Thread(target=harness.guard(supervise), daemon=True,
+                                name='%s/%s' % (account['exchange'], account['name']), args=(
+            functools.partial(run_account, db, account, cache_path(config, account['exchange'])),
+            'Order synchronization [%s/%s]' % (account['exchange'], account['name'])))
+        task.start()
+        tasks.append(task)
+
+    while any(task.is_alive() for task in tasks):
+        if not harness.replaying:
+            checkpoint.maybe_save(state)
+        time.sleep(5 if not harness.replaying else 0.1)
+
+    # Account loops of a replay stop at the end of the recording
+    if harness.replaying:
+        return
+    raise Exception("All account loops stopped")
+
+
+try:
+    supervise(run, 'Order synchronization')
 except Exception as e:
     print("Error: %s" % e)
 finally:
+    profiler.close()
+    harness.close()
     print("Stopped")